@@ -1,423 +1,540 @@
-import requests
 import json
-import sqlite3
 import os
-import math
+import re
 import logging
-import google.generativeai as genai
 from dotenv import load_dotenv
 
-import re
+import ai_providers
+import hpb_index
+import hpb_lexical
+import hpb_nutrients
+import candidate_packing
+import embedding_cache
+import image_prep
+import key_scheduler
+import metrics
+import result_cache
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuration
 DB_PATH = "calorie_tracker.db"
-
-def parse_portion_unit(portion_str):
-    """Parses strings like '1 plate(s) = 418g' to extract the unit."""
-    if not portion_str or portion_str == "-":
-        return "unit"
-    clean = portion_str.replace("(s)", "").strip()
-    match = re.search(r'\d+\s+(.*?)\s*=', clean)
-    if match:
-        return match.group(1).strip()
-    parts = clean.split()
-    if parts and not parts[0].isdigit():
-        return parts[0]
-    if len(parts) > 1:
-        return parts[1]
-    return "unit"
+# Bump whenever prompts, models or retrieval change so cached results are not reused
+PIPELINE_VERSION = "4"
+# "multipass": detection -> retrieval -> judge (label path: detection -> extraction)
+# "single": retrieval on description + cheap detection, then one schema-constrained call
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "multipass")
+DETECTION_MODEL = os.getenv("DETECTION_MODEL", "gemini-2.0-flash-lite")
+DETECTION_MAX_EDGE = int(os.getenv("DETECTION_MAX_EDGE", "512"))
+# Fuse FTS5/BM25 hits with vector search (and skip embedding exact name matches)
+HYBRID_RETRIEVAL = os.getenv("HPB_HYBRID_SEARCH", "1") == "1"
 
 # API Key Rotation Logic
 PRIMARY_KEY = os.getenv("GOOGLE_API_KEY")
 SECONDARY_KEY = os.getenv("GOOGLE_API_KEY_2")
 
-def get_rotating_key():
-    """Simple toggle between two keys based on a counter file or random."""
-    if not SECONDARY_KEY:
-        return PRIMARY_KEY
+
+def available_keys():
+    """Indices of the configured API keys (0 = primary, 1 = secondary)."""
+    if ai_providers.AI_PROVIDER == "fake":
+        return [0, 1]
+    return [idx for idx, key in enumerate((PRIMARY_KEY, SECONDARY_KEY)) if key]
+
+def get_provider(key_index):
+    """The reusable generate/embed client for one key slot."""
+    return ai_providers.get_provider(key_index, (PRIMARY_KEY, SECONDARY_KEY)[key_index])
+
+def embed_queries(queries):
+    """
+    Embed retrieval queries, serving repeats from the query embedding cache.
+    All cache misses are embedded together in a single embed_content call.
+    """
+    vectors = [embedding_cache.get(q) for q in queries]
     
-    toggle_file = "api_toggle.tmp"
-    try:
-        if os.path.exists(toggle_file):
-            with open(toggle_file, "r") as f:
-                state = f.read().strip()
-            new_state = "secondary" if state == "primary" else "primary"
-        else:
-            new_state = "secondary"
-            
-        with open(toggle_file, "w") as f:
-            f.write(new_state)
-            
-        return SECONDARY_KEY if new_state == "secondary" else PRIMARY_KEY
-    except:
-        return PRIMARY_KEY
-
-def configure_genai(key_index=None):
-    """Configure genai with a specific key or the current rotating key."""
-    if key_index == 0:
-        genai.configure(api_key=PRIMARY_KEY)
-        return PRIMARY_KEY
-    if key_index == 1:
-        genai.configure(api_key=SECONDARY_KEY)
-        return SECONDARY_KEY
-        
-    key = get_rotating_key()
-    genai.configure(api_key=key)
-    return key
-
-HPB_DETAILS_URL = "https://pphtpc.hpb.gov.sg/bff/v1/food-portal/foods/details/{crId}"
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-    "Accept": "application/json"
-}
+    misses = []
+    for q, vec in zip(queries, vectors):
+        if vec is None and q not in misses:
+            misses.append(q)
+    
+    if misses:
+        embeddings = _embed_scheduled(misses)
+        fresh = dict(zip(misses, embeddings))
+        for q, vec in fresh.items():
+            embedding_cache.put(q, vec)
+        vectors = [vec if vec is not None else fresh[q] for q, vec in zip(queries, vectors)]
+    
+    return vectors
 
-def cosine_similarity(v1, v2):
-    dot_product = sum(x*y for x, y in zip(v1, v2))
-    magnitude1 = math.sqrt(sum(x*x for x in v1))
-    magnitude2 = math.sqrt(sum(x*x for x in v2))
-    return dot_product / (magnitude1 * magnitude2) if magnitude1 and magnitude2 else 0
+def _embed_scheduled(texts):
+    """One embed call on the healthiest (key, EMBEDDING_MODEL) pair, feeding the outcome back to the scheduler."""
+    keys = available_keys()
+    last_error = None
+    for k_idx, m_name in key_scheduler.plan(keys, [hpb_index.EMBEDDING_MODEL]):
+        try:
+            with metrics.span("embedding"):
+                embeddings = get_provider(k_idx).embed(texts, m_name)
+            key_scheduler.record_success(k_idx, m_name)
+            return embeddings
+        except Exception as e:
+            last_error = e
+            kind = key_scheduler.record_error(k_idx, m_name, e)
+            print(f"Embedding {kind} error with Key {k_idx} and Model {m_name}: {e}")
+            if kind == "fatal":
+                break
+    if last_error is None:
+        raise key_scheduler.QuotaExhausted(key_scheduler.seconds_until_available(keys, [hpb_index.EMBEDDING_MODEL]))
+    raise last_error
 
-def get_semantic_candidates(query, limit=10):
-    """Retrieve top candidates from local DB using vector similarity."""
-    try:
-        configure_genai()
-        # 1. Embed the query
-        res = genai.embed_content(
-            model="models/text-embedding-004", 
-            content=query, 
-            task_type="retrieval_query"
-        )
-        query_vec = res['embedding']
-        
-        # 2. Get all embeddings from DB
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT h.name, h.crId, h.description, e.embedding, h.default_unit, h.default_weight
-            FROM hpb_foods h 
-            JOIN hpb_embeddings e ON h.crId = e.crId
-        """)
-        rows = cursor.fetchall()
-        conn.close()
-        
-        # 3. Rank by similarity
-        scored_items = []
-        for name, crId, desc, emb_json, unit, weight in rows:
-            emb = json.loads(emb_json)
-            score = cosine_similarity(query_vec, emb)
-            scored_items.append({
-                "name": name, 
-                "crId": crId, 
-                "desc": desc, 
-                "score": score,
-                "unit": unit or "unit",
-                "weight": weight or 0
-            })
-            
-        scored_items.sort(key=lambda x: x["score"], reverse=True)
-        return scored_items[:limit]
-    except Exception as e:
-        print(f"Semantic search error: {e}")
+def embed_query(query):
+    """Embed a single retrieval query (cached)."""
+    return embed_queries([query])[0]
+
+def get_semantic_candidates_batch(items, limit=10):
+    """
+    Retrieve top candidates for every item of a meal at once: one embedding
+    round trip and one matrix-matrix product against the HPB index.
+    With hybrid retrieval on, BM25 hits from the FTS5 index are fused in via
+    reciprocal rank fusion, and items whose text literally names an HPB food
+    skip the embedding call entirely.
+    Returns a candidate list per item, in input order.
+    """
+    items = list(items)
+    if not items:
         return []
+    
+    lexical = None
+    semantic_items = items
+    if HYBRID_RETRIEVAL:
+        with metrics.span("lexical_search"):
+            lexical = hpb_lexical.search_many(items, limit=limit)
+        # Fast path: exact dish-name matches need no embedding
+        semantic_items = [item for item, hits in zip(items, lexical) if not hpb_lexical.is_confident(item, hits)]
+    
+    semantic = {}
+    if semantic_items:
+        try:
+            # Embed the queries (cached, misses batched), then rank against the pre-normalized catalogue matrix
+            query_vecs = embed_queries(semantic_items)
+            with metrics.span("vector_search"):
+                semantic = dict(zip(semantic_items, hpb_index.get_index().search_many(query_vecs, limit=limit)))
+        except Exception as e:
+            # Embedding quota or index trouble: keep whatever BM25 found rather than nothing
+            logger.warning(f"Semantic search failed, using lexical candidates only: {e}")
+            if lexical is None:
+                with metrics.span("lexical_search"):
+                    lexical = hpb_lexical.search_many(items, limit=limit)
+    
+    if lexical is None:
+        return [semantic.get(item, []) for item in items]
+    return [
+        hpb_lexical.rrf_fuse([semantic.get(item, []), hits], limit=limit)
+        for item, hits in zip(items, lexical)
+    ]
+
+def get_semantic_candidates(query, limit=10):
+    """Retrieve top candidates from the in-memory HPB index using vector similarity."""
+    return get_semantic_candidates_batch([query], limit=limit)[0]
 
 def fetch_hpb_details(crId):
-    """Fetch nutrition data for a specific crId."""
-    try:
-        url = HPB_DETAILS_URL.format(crId=crId)
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            nutrients = data.get("calculatedFoodNutrients", {})
-            raw_portion = data.get("defaultPortion", "")
-            return {
-                "calories": round(nutrients.get("energy", 0)),
-                "protein": round(nutrients.get("protein", 0)),
-                "carbs": round(nutrients.get("carbohydrate", 0)),
-                "fat": round(nutrients.get("fat", 0)),
-                "unit": parse_portion_unit(raw_portion)
-            }
-    except Exception as e:
-        print(f"Error fetching HPB details for {crId}: {e}")
-    return None
+    """Nutrition data for a specific crId, served from the local nutrient store."""
+    return hpb_nutrients.get_details(crId)
 
-def estimate_calories(image_paths: list = None, user_description: str = None):
-    # Model Rotation Pool: We'll try the best ones first
-    MODELS_TO_TRY = [
-        'gemini-2.0-flash-lite',
-        'gemini-flash-latest',
-        'gemini-pro-latest'
-    ]
+def estimate_calories(image_paths: list = None, user_description: str = None, use_cache: bool = True, mode: str = None):
+    """
+    Analyse a meal. Identical photos + description are served from the
+    result cache; pass use_cache=False to force a fresh run (admin rerun).
+    mode overrides PIPELINE_MODE ("multipass" or "single").
+    """
+    mode = mode or PIPELINE_MODE
+    # Normalize images once; the same bytes feed the cache key and every model call
+    with metrics.span("image_prep"):
+        image_parts = image_prep.prepare_images(image_paths)
+    key = result_cache.make_key([part["data"] for part in image_parts], user_description, f"{PIPELINE_VERSION}:{mode}")
+    
+    if use_cache:
+        with metrics.span("result_cache"):
+            cached = result_cache.get(key)
+        metrics.inc("fuel_result_cache_total", result="hit" if cached else "miss")
+        if cached:
+            print("Returning cached analysis result.")
+            return cached
     
-    # Try both keys
-    keys_to_try = [0, 1] if SECONDARY_KEY else [0]
-    current_key_idx = 0 if get_rotating_key() == PRIMARY_KEY else 1
-    if current_key_idx == 1:
-        keys_to_try = [1, 0]
+    with metrics.span("pipeline", mode=mode):
+        result = _run_pipeline(image_parts, user_description, mode)
     
+    # Only remember real answers, never the "Unknown" failure fallback
+    if result[0] != "Unknown" or result[1]:
+        result_cache.put(key, result)
+    return result
+
+def _run_pipeline(image_parts: list = None, user_description: str = None, mode: str = None):
+    mode = mode or PIPELINE_MODE
+    keys = available_keys()
+    if not keys:
+        print("Pipeline Error: no GOOGLE_API_KEY configured")
+        return "Unknown", 0, 0, 0, 0, []
     last_error = None
+    attempts, throttled = 0, 0
     
-    # Nested loop: For each key, try rotating models if we hit a 429
-    for k_idx in keys_to_try:
-        configure_genai(k_idx)
-        
-        for m_name in MODELS_TO_TRY:
-            try:
-                print(f"Attempting analysis with Key {k_idx} and Model {m_name}...")
-                model = genai.GenerativeModel(m_name)
-                
-                contents = []
-                processed_temp_files = []
-                
-                if image_paths:
-                    import PIL.Image
-                    for path in image_paths:
-                        temp_path = f"{path}_std.jpg"
-                        try:
-                            with PIL.Image.open(path) as img:
-                                if getattr(img, "n_frames", 1) > 1:
-                                    img.seek(0)
-                                rgb_img = img.convert('RGB')
-                                rgb_img.save(temp_path, 'JPEG')
-                            contents.append(PIL.Image.open(temp_path))
-                            processed_temp_files.append(temp_path)
-                        except Exception as e:
-                            print(f"Error standardizing image {path}: {e}")
-                            try:
-                                contents.append(PIL.Image.open(path))
-                            except:
-                                pass
-
-                desc_part = f"\nUser description: {user_description}" if user_description else ""
-                
-                # TASK 1: Identification & Label Detection
-                id_prompt = f"""
-                Analyze this meal photo and description.
-                
-                TASK 1: DETECTION
-                Identify every distinct food item and drink. 
-                STRICT SUBJECT RULES:
-                1. PRIMARY ONLY: Focus ONLY on the items that are the main subject.
-                2. IGNORE EDGES/CROPPED: Omit items at edges or partially cut off.
-                
-                TASK 2: NUTRITION LABEL DETECTION
-                Check if there is a clear, legible Nutrition Information Panel (NIP) or Food Label visible in the photo that specifies calories/macros for the primary item.
-                
-                {desc_part}
-                
-                Respond in the following format:
-                LABEL_FOUND: [YES/NO]
-                ITEMS: [Comma-separated list of items]
-                """
-                
-                response = model.generate_content([id_prompt] + contents)
-                text = response.text.strip()
-                
-                label_found = False
-                identified_items = []
-                
-                for line in text.split('\n'):
-                    if "LABEL_FOUND:" in line:
-                        label_found = "YES" in line.upper()
-                    if "ITEMS:" in line:
-                        identified_items = [x.strip() for x in line.split("ITEMS:")[1].split(",")]
-                
-                # If identifying items failed via format, fallback to previous simple logic
-                if not identified_items:
-                    if '\n' in text:
-                        identified_items = [x.strip() for x in text.split('\n')][-1].split(',')
-                    else:
-                        identified_items = [x.strip() for x in text.split(',')]
-
-                # OPTION A: DIRECT EXTRACTION FROM LABEL
-                if label_found:
-                    print("Nutrition Label detected! Switching to Direct Extraction mode...")
-                    extract_prompt = f"""
-                    You are a nutrition expert. A clear food label has been detected in this image.
-                    
-                    USER DESCRIPTION: {user_description}
-                    
-                    TASK:
-                    1. Read the nutrition label in the image.
-                    2. Extract: Calories, Protein, Carbs, and Fat.
-                    3. Calculate the total based on the quantity consumed mentioned in the description (if any).
-                    
-                    Return JSON:
-                    {{
-                      "food_summary": "Name of Product on Label",
-                      "calories": 0,
-                      "protein": 0,
-                      "carbs": 0,
-                      "fat": 0,
-                      "items": [
-                        {{
-                          "name": "Item from Label", 
-                          "portion": 1.0,
-                          "cal": 0,
-                          "p": 0,
-                          "c": 0,
-                          "f": 0
-                        }}
-                      ]
-                    }}
-                    """
-                    extract_resp = model.generate_content([extract_prompt] + contents)
-                    extract_text = extract_resp.text.strip()
-                    
-                    # JSON extraction
-                    if '```json' in extract_text:
-                        clean_json = extract_text.split('```json')[1].split('```')[0].strip()
-                    else:
-                        start = extract_text.find('{')
-                        end = extract_text.rfind('}')
-                        clean_json = extract_text[start:end+1] if start != -1 and end != -1 else extract_text
-                    
-                    res = json.loads(clean_json)
-                    return (
-                        res.get("food_summary", "Label Detected"),
-                        res.get("calories", 0),
-                        res.get("protein", 0),
-                        res.get("carbs", 0),
-                        res.get("fat", 0),
-                        res.get("items", [])
-                    )
-
-                # OPTION B: STANDARD 2-PASS PIPELINE
-                # Pass 2: Candidate Retrieval (Semantic Search)
-                all_matches = []
-                for item in identified_items:
-                    candidates = get_semantic_candidates(item, limit=10)
-                    # Clean candidates for the prompt to keep it small but include units
-                    clean_candidates = [
-                        {"name": c["name"], "crId": c["crId"], "unit": c.get("unit", "unit"), "desc": c["desc"]}
-                        for c in candidates
-                    ]
-                    all_matches.append({"query": item, "candidates": clean_candidates})
-
-                # Pass 3: Grounded Judging & Portions
-                judge_prompt = f"""
-                You are a nutrition expert matching real meals to an official database.
-                
-                Original User Description: {user_description}
-                Identified Items: {", ".join(identified_items)}
-                
-                For each item identified, look at the photo (if provided) and pick the best match from the provided HPB candidates.
-                
-                CRITICAL INSTRUCTION FOR ACCURACY:
-                1. USER TEXT PRIORITY: If the user mentions a quantity or portion (e.g., "5 pieces", "half", "1 slice", "shared"), you MUST use that instead of the visual.
-                2. UNIT CONVERSION RULE: If the user specifies a quantity in a small unit (e.g., "tablespoon", "teaspoon", "scoop") but the HPB candidate unit is larger (e.g., "cup", "bowl", "plate"), you MUST calculate the portion as a fraction.
-                   - Example: "4 tablespoons" of yoghurt vs "1 small cup (150g)" -> portion is ~0.4.
-                   - NEVER return a huge multiplier (like 68.0) for a single bowl/cup item unless the user explicitly says they ate 68 bowls.
-                3. UNIT AWARENESS: Look at the "unit" field for each candidate. If the unit is "plate" and the user has a small side portion, adjust portion to 0.3 or similar.
-                3. THE "BISCUIT" RULE: For Cream Crackers or Biscuits, the HPB database standard is 1 PIECE. If a user says "5 pieces", you MUST set portion to 5.0.
-                4. NO IMAGE RULE: If NO images are provided, assume standard serving (portion: 1.0) for identified items UNLESS a quantity is specified in the text.
-                5. THE "SLICE" RULE: Items like "Ngoh Hiang" or "Fish Cake" are often defined as a WHOLE ROLL. If the user mentions a "SLICE", adjust portion to ~0.1 - 0.2.
-                6. THE "DAB" RULE: For condiments like Sambal, Chili, or Soy Sauce, if it is a small side portion (e.g. in a plastic saucer or on the side), adjust portion to ~0.1 (approx 10-15 kcal). Do not treat it as a main dish.
-                7. STRICT PRIMARY FOCUS: Strictly OMIT any items that are at the edges, corners, or partially cropped out of the frame. Focus only on the central, intended subject of the meal.
-                8. PORTION SCALING: 1.0 = standard serving, 0.5 = half, 1.5 = large. Lean toward 1.0 for health-conscious users unless cues are obvious.
-                
-                HPB CANDIDATES:
-                {json.dumps(all_matches)}
-                
-                If an item has NO reasonable match in the list, set "crId" to null and provide your own best estimate for macros and a standard "unit".
-                
-                Return JSON:
-                {{
-                  "food_summary": "Overall Meal Name",
-                  "items": [
-                    {{"name": "Item Name", "crId": "FXXXX", "portion": 1.0, "unit": "unit", "est_cal": 0, "est_p": 0, "est_c": 0, "est_f": 0}}
-                  ]
-                }}
-                """
-                
-                judge_resp = model.generate_content([judge_prompt] + contents)
-                resp_text = judge_resp.text.strip()
-                
-                if '```json' in resp_text:
-                    clean_json = resp_text.split('```json')[1].split('```')[0].strip()
-                elif '```' in resp_text:
-                    clean_json = resp_text.split('```')[1].split('```')[0].strip()
-                else:
-                    start = resp_text.find('{')
-                    end = resp_text.rfind('}')
-                    clean_json = resp_text[start:end+1] if start != -1 and end != -1 else resp_text
-
-                result_data = json.loads(clean_json)
-                
-                total_cal, total_p, total_c, total_f = 0, 0, 0, 0
-                final_items = []
-                
-                for item in result_data.get("items", []):
-                    portion = item.get("portion", 1.0)
-                    if item.get("crId"):
-                        hpb_data = fetch_hpb_details(item["crId"])
-                        if hpb_data:
-                            total_cal += round(hpb_data["calories"] * portion)
-                            total_p += round(hpb_data["protein"] * portion)
-                            total_c += round(hpb_data["carbs"] * portion)
-                            total_f += round(hpb_data["fat"] * portion)
-                            final_items.append({
-                                "name": item["name"], 
-                                "portion": portion,
-                                "unit": hpb_data.get("unit", "unit"),
-                                "cal": round(hpb_data["calories"]),
-                                "p": round(hpb_data["protein"]),
-                                "c": round(hpb_data["carbs"]),
-                                "f": round(hpb_data["fat"])
-                            })
-                            continue
-                    
-                    total_cal += round(item.get("est_cal", 0) * portion)
-                    total_p += round(item.get("est_p", 0) * portion)
-                    total_c += round(item.get("est_c", 0) * portion)
-                    total_f += round(item.get("est_f", 0) * portion)
-                    final_items.append({
-                        "name": item["name"], 
-                        "portion": portion,
-                        "unit": item.get("unit", "unit"),
-                        "cal": round(item.get("est_cal", 0)),
-                        "p": round(item.get("est_p", 0)),
-                        "c": round(item.get("est_c", 0)),
-                        "f": round(item.get("est_f", 0))
-                    })
-
-                for f in processed_temp_files:
-                    if os.path.exists(f):
-                        try: os.remove(f)
-                        except: pass
-
-                return (result_data.get("food_summary", "Unknown"), total_cal, total_p, total_c, total_f, final_items)
-
-            except Exception as e:
-                last_error = e
-                if "429" in str(e):
-                    print(f"Key {k_idx} + Model {m_name} hit rate limit, trying next permutation...")
-                    continue
-                else:
-                    print(f"Non-429 error with {m_name}: {e}")
-                    continue
-
-    print(f"Pipeline Error after trying ALL keys and models: {last_error}")
+    # The scheduler hands out the healthiest (key, model) pair and skips ones whose breaker is open
+    for k_idx, m_name in key_scheduler.plan(keys):
+        attempts += 1
+        try:
+            print(f"Attempting analysis with Key {k_idx} and Model {m_name}...")
+            provider = get_provider(k_idx)
+            
+            contents = list(image_parts or [])
+            
+            if mode == "single":
+                result = _analyse_single_call(provider, m_name, contents, user_description)
+            else:
+                result = _analyse_multipass(provider, m_name, contents, user_description)
+            key_scheduler.record_success(k_idx, m_name)
+            return result
+
+        except Exception as e:
+            last_error = e
+            kind = key_scheduler.record_error(k_idx, m_name, e)
+            if kind == "rate_limit":
+                throttled += 1
+                continue
+            print(f"{kind} error with Key {k_idx} and Model {m_name}: {e}")
+            if kind == "fatal":
+                break
+
+    # Every pair we could reach is throttled: that is a quota event, not an "Unknown" meal
+    if throttled == attempts and (attempts or key_scheduler.is_throttled(keys)):
+        raise key_scheduler.QuotaExhausted(key_scheduler.seconds_until_available(keys))
+    print(f"Pipeline Error after trying ALL keys and models: {last_error or 'every breaker is open'}")
     return "Unknown", 0, 0, 0, 0, []
 
+PORTION_RULES = """
+CRITICAL INSTRUCTION FOR ACCURACY:
+1. USER TEXT PRIORITY: If the user mentions a quantity or portion (e.g., "5 pieces", "half", "1 slice", "shared"), you MUST use that instead of the visual.
+2. UNIT CONVERSION RULE: If the user specifies a quantity in a small unit (e.g., "tablespoon", "teaspoon", "scoop") but the HPB candidate unit is larger (e.g., "cup", "bowl", "plate"), you MUST calculate the portion as a fraction.
+   - Example: "4 tablespoons" of yoghurt vs "1 small cup (150g)" -> portion is ~0.4.
+   - NEVER return a huge multiplier (like 68.0) for a single bowl/cup item unless the user explicitly says they ate 68 bowls.
+3. UNIT AWARENESS: Look at the "unit" field for each candidate. If the unit is "plate" and the user has a small side portion, adjust portion to 0.3 or similar.
+3. THE "BISCUIT" RULE: For Cream Crackers or Biscuits, the HPB database standard is 1 PIECE. If a user says "5 pieces", you MUST set portion to 5.0.
+4. NO IMAGE RULE: If NO images are provided, assume standard serving (portion: 1.0) for identified items UNLESS a quantity is specified in the text.
+5. THE "SLICE" RULE: Items like "Ngoh Hiang" or "Fish Cake" are often defined as a WHOLE ROLL. If the user mentions a "SLICE", adjust portion to ~0.1 - 0.2.
+6. THE "DAB" RULE: For condiments like Sambal, Chili, or Soy Sauce, if it is a small side portion (e.g. in a plastic saucer or on the side), adjust portion to ~0.1 (approx 10-15 kcal). Do not treat it as a main dish.
+7. STRICT PRIMARY FOCUS: Strictly OMIT any items that are at the edges, corners, or partially cropped out of the frame. Focus only on the central, intended subject of the meal.
+8. PORTION SCALING: 1.0 = standard serving, 0.5 = half, 1.5 = large. Lean toward 1.0 for health-conscious users unless cues are obvious.
+"""
+
+def _resolve_items(result_items, food_summary):
+    """Price the judged items: HPB values for matched crIds, model estimates otherwise."""
+    total_cal, total_p, total_c, total_f = 0, 0, 0, 0
+    final_items = []
+
+    # Resolve all matched crIds at once (local store first, then concurrent fetches)
+    with metrics.span("hpb_fetch"):
+        hpb_details = hpb_nutrients.get_details_many(
+            [item["crId"] for item in result_items if item.get("crId")]
+        )
+
+    for item in result_items:
+        portion = item.get("portion", 1.0)
+        if item.get("crId"):
+            hpb_data = hpb_details.get(item["crId"])
+            if hpb_data:
+                total_cal += round(hpb_data["calories"] * portion)
+                total_p += round(hpb_data["protein"] * portion)
+                total_c += round(hpb_data["carbs"] * portion)
+                total_f += round(hpb_data["fat"] * portion)
+                final_items.append({
+                    "name": item["name"], 
+                    "portion": portion,
+                    "unit": hpb_data.get("unit", "unit"),
+                    "cal": round(hpb_data["calories"]),
+                    "p": round(hpb_data["protein"]),
+                    "c": round(hpb_data["carbs"]),
+                    "f": round(hpb_data["fat"])
+                })
+                continue
+
+        total_cal += round(item.get("est_cal", 0) * portion)
+        total_p += round(item.get("est_p", 0) * portion)
+        total_c += round(item.get("est_c", 0) * portion)
+        total_f += round(item.get("est_f", 0) * portion)
+        final_items.append({
+            "name": item["name"], 
+            "portion": portion,
+            "unit": item.get("unit", "unit"),
+            "cal": round(item.get("est_cal", 0)),
+            "p": round(item.get("est_p", 0)),
+            "c": round(item.get("est_c", 0)),
+            "f": round(item.get("est_f", 0))
+        })
+
+    return (food_summary, total_cal, total_p, total_c, total_f, final_items)
+
+def _analyse_multipass(provider, model_name, contents, user_description):
+    """Detection / label check, retrieval, then a grounded judge call."""
+    desc_part = f"\nUser description: {user_description}" if user_description else ""
+
+    # TASK 1: Identification & Label Detection
+    id_prompt = f"""
+    Analyze this meal photo and description.
+
+    TASK 1: DETECTION
+    Identify every distinct food item and drink. 
+    STRICT SUBJECT RULES:
+    1. PRIMARY ONLY: Focus ONLY on the items that are the main subject.
+    2. IGNORE EDGES/CROPPED: Omit items at edges or partially cut off.
+
+    TASK 2: NUTRITION LABEL DETECTION
+    Check if there is a clear, legible Nutrition Information Panel (NIP) or Food Label visible in the photo that specifies calories/macros for the primary item.
+
+    {desc_part}
+
+    Respond in the following format:
+    LABEL_FOUND: [YES/NO]
+    ITEMS: [Comma-separated list of items]
+    """
+
+    with metrics.span("detection"):
+        text = provider.generate(model_name, [id_prompt] + contents).strip()
+
+    label_found = False
+    identified_items = []
+
+    for line in text.split('\n'):
+        if "LABEL_FOUND:" in line:
+            label_found = "YES" in line.upper()
+        if "ITEMS:" in line:
+            identified_items = [x.strip() for x in line.split("ITEMS:")[1].split(",")]
+
+    # If identifying items failed via format, fallback to previous simple logic
+    if not identified_items:
+        if '\n' in text:
+            identified_items = [x.strip() for x in text.split('\n')][-1].split(',')
+        else:
+            identified_items = [x.strip() for x in text.split(',')]
+
+    # OPTION A: DIRECT EXTRACTION FROM LABEL
+    if label_found:
+        print("Nutrition Label detected! Switching to Direct Extraction mode...")
+        extract_prompt = f"""
+        You are a nutrition expert. A clear food label has been detected in this image.
+
+        USER DESCRIPTION: {user_description}
+
+        TASK:
+        1. Read the nutrition label in the image.
+        2. Extract: Calories, Protein, Carbs, and Fat.
+        3. Calculate the total based on the quantity consumed mentioned in the description (if any).
+
+        Return JSON:
+        {{
+          "food_summary": "Name of Product on Label",
+          "calories": 0,
+          "protein": 0,
+          "carbs": 0,
+          "fat": 0,
+          "items": [
+            {{
+              "name": "Item from Label", 
+              "portion": 1.0,
+              "cal": 0,
+              "p": 0,
+              "c": 0,
+              "f": 0
+            }}
+          ]
+        }}
+        """
+        with metrics.span("label_extraction"):
+            extract_text = provider.generate(model_name, [extract_prompt] + contents).strip()
+
+        # JSON extraction
+        if '```json' in extract_text:
+            clean_json = extract_text.split('```json')[1].split('```')[0].strip()
+        else:
+            start = extract_text.find('{')
+            end = extract_text.rfind('}')
+            clean_json = extract_text[start:end+1] if start != -1 and end != -1 else extract_text
+
+        res = json.loads(clean_json)
+        return (
+            res.get("food_summary", "Label Detected"),
+            res.get("calories", 0),
+            res.get("protein", 0),
+            res.get("carbs", 0),
+            res.get("fat", 0),
+            res.get("items", [])
+        )
+
+    # OPTION B: STANDARD 2-PASS PIPELINE
+    # Pass 2: Candidate Retrieval (Semantic Search)
+    identified_items = [x.strip() for x in identified_items if x.strip()]
+    with metrics.span("retrieval"):
+        batch_candidates = get_semantic_candidates_batch(identified_items, limit=10)
+    all_matches = [
+        {"query": item, "candidates": candidates}
+        for item, candidates in zip(identified_items, batch_candidates)
+    ]
+
+    # Pass 3: Grounded Judging & Portions
+    judge_prompt = f"""
+    You are a nutrition expert matching real meals to an official database.
+
+    Original User Description: {user_description}
+    Identified Items: {", ".join(identified_items)}
+
+    For each item identified, look at the photo (if provided) and pick the best match from the provided HPB candidates.
+
+    {PORTION_RULES}
+
+    HPB CANDIDATES (per item: crIds best first; details for each crId are in "reference"):
+    {candidate_packing.render(all_matches)}
+
+    If an item has NO reasonable match in the list, set "crId" to null and provide your own best estimate for macros and a standard "unit".
+
+    Return JSON:
+    {{
+      "food_summary": "Overall Meal Name",
+      "items": [
+        {{"name": "Item Name", "crId": "FXXXX", "portion": 1.0, "unit": "unit", "est_cal": 0, "est_p": 0, "est_c": 0, "est_f": 0}}
+      ]
+    }}
+    """
+
+    with metrics.span("judge"):
+        resp_text = provider.generate(model_name, [judge_prompt] + contents).strip()
+
+    if '```json' in resp_text:
+        clean_json = resp_text.split('```json')[1].split('```')[0].strip()
+    elif '```' in resp_text:
+        clean_json = resp_text.split('```')[1].split('```')[0].strip()
+    else:
+        start = resp_text.find('{')
+        end = resp_text.rfind('}')
+        clean_json = resp_text[start:end+1] if start != -1 and end != -1 else resp_text
+
+    result_data = json.loads(clean_json)
+    
+    return _resolve_items(result_data.get("items", []), result_data.get("food_summary", "Unknown"))
+
+# Response schemas for the single-call pipeline (schema-constrained JSON output)
+DETECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["items"]
+}
+
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "food_summary": {"type": "string"},
+        "label_found": {"type": "boolean"},
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "crId": {"type": "string", "nullable": True},
+                    "portion": {"type": "number"},
+                    "unit": {"type": "string"},
+                    "est_cal": {"type": "number"},
+                    "est_p": {"type": "number"},
+                    "est_c": {"type": "number"},
+                    "est_f": {"type": "number"}
+                },
+                "required": ["name", "portion", "unit", "est_cal", "est_p", "est_c", "est_f"]
+            }
+        }
+    },
+    "required": ["food_summary", "label_found", "items"]
+}
+
+def _description_queries(user_description):
+    """Split free text like 'chicken rice with egg, kopi' into retrieval queries."""
+    if not user_description:
+        return []
+    parts = re.split(r",|;|\n|\band\b|\bwith\b|\+", user_description, flags=re.IGNORECASE)
+    return [p.strip() for p in parts if len(p.strip()) > 1]
+
+def _detect_items(contents):
+    """
+    Cheap detection pass on small images, scheduled on its own (key, DETECTION_MODEL)
+    pairs so its 429s throttle the detection model rather than the main one.
+    Returns [] when every detection pair fails; the main call still sees the photos.
+    """
+    small = image_prep.shrink_parts(contents, DETECTION_MAX_EDGE)
+    for k_idx, m_name in key_scheduler.plan(available_keys(), [DETECTION_MODEL]):
+        try:
+            with metrics.span("detection"):
+                detect_text = get_provider(k_idx).generate(
+                    m_name,
+                    ["List every distinct food item and drink that is the main subject of this meal photo. "
+                     "Omit items at the edges or partially cut off."] + small,
+                    response_schema=DETECTION_SCHEMA
+                )
+            items = json.loads(detect_text).get("items", [])
+            key_scheduler.record_success(k_idx, m_name)
+            return items
+        except Exception as e:
+            kind = key_scheduler.record_error(k_idx, m_name, e)
+            print(f"Detection {kind} error with Key {k_idx} and Model {m_name}: {e}")
+            if kind == "fatal":
+                break
+    return []
+
+def _analyse_single_call(provider, model_name, contents, user_description):
+    """
+    Retrieval first (description + a cheap detection pass on small images),
+    then ONE schema-constrained call that returns items, crIds and portions,
+    covering nutrition labels too.
+    """
+    queries = _description_queries(user_description)
+    if contents:
+        queries += _detect_items(contents)
+    queries = list(dict.fromkeys(q.strip() for q in queries if q and q.strip()))
+
+    with metrics.span("retrieval"):
+        batch_candidates = get_semantic_candidates_batch(queries, limit=10)
+    all_matches = [
+        {"query": query, "candidates": candidates}
+        for query, candidates in zip(queries, batch_candidates)
+    ]
+
+    prompt = f"""
+    You are a nutrition expert matching real meals to an official database.
+
+    Original User Description: {user_description}
+
+    1. Identify every distinct food item and drink that is the main subject of the photo(s) and/or description.
+    2. NUTRITION LABEL: if a clear, legible Nutrition Information Panel is visible for the primary item, set
+       "label_found" to true, read the per-serving macros from the label into est_* for that item, set its
+       "crId" to null and its portion to the number of servings consumed.
+    3. Otherwise pick the best match for each item from the HPB candidates below and set its "crId".
+       If nothing fits, set "crId" to null and give your own per-unit estimate in est_*.
+
+    {PORTION_RULES}
+
+    HPB CANDIDATES (per item: crIds best first; details for each crId are in "reference"):
+    {candidate_packing.render(all_matches)}
+    """
+
+    with metrics.span("judge"):
+        resp_text = provider.generate(model_name, [prompt] + contents, response_schema=ANALYSIS_SCHEMA)
+    result_data = json.loads(resp_text)
+    if result_data.get("label_found"):
+        print("Nutrition Label detected (single-call mode).")
+    return _resolve_items(result_data.get("items", []), result_data.get("food_summary", "Unknown"))
+
 def generate_daily_summary(meals_list, target_calories):
     """Generates a human-friendly summary acting as a nutrition coach with retry logic."""
     if not meals_list:
         return "No data recorded for today."
 
-    # Use Matrix Rotation for summaries too
-    MODELS_TO_TRY = [
-        'gemini-2.0-flash-lite',
-        'gemini-flash-latest',
-        'gemini-pro-latest'
-    ]
-    
-    keys_to_try = [0, 1] if SECONDARY_KEY else [0]
-    current_key_idx = 0 if get_rotating_key() == PRIMARY_KEY else 1
-    if current_key_idx == 1:
-        keys_to_try = [1, 0]
-
     meals_data = [
         {"food": m.food_name, "desc": m.description, "cal": m.calories, "p": m.protein, "c": m.carbs, "f": m.fat}
         for m in meals_list
@@ -439,17 +556,18 @@ def generate_daily_summary(meals_list, target_calories):
     """
 
     last_error = None
-    for k_idx in keys_to_try:
-        configure_genai(k_idx)
-        for m_name in MODELS_TO_TRY:
-            try:
-                model = genai.GenerativeModel(m_name)
-                response = model.generate_content(prompt)
-                return response.text.strip()
-            except Exception as e:
-                last_error = e
-                print(f"Summary generation error with Key {k_idx} and Model {m_name}: {e}")
-                continue
+    for k_idx, m_name in key_scheduler.plan(available_keys()):
+        try:
+            with metrics.span("summary"):
+                text = get_provider(k_idx).generate(m_name, [prompt])
+            key_scheduler.record_success(k_idx, m_name)
+            return text.strip()
+        except Exception as e:
+            last_error = e
+            kind = key_scheduler.record_error(k_idx, m_name, e)
+            print(f"Summary generation error with Key {k_idx} and Model {m_name}: {e}")
+            if kind == "fatal":
+                break
 
     print(f"Final Summary error after trying all: {last_error}")
     return None
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import numpy as np
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.api_core import exceptions as api_exceptions
+
+# "gemini" talks to Google; "fake" is the deterministic offline stand-in used by benchmarks
+AI_PROVIDER = os.getenv("AI_PROVIDER", "gemini")
+# Fake provider knobs: seconds per call and the fraction of calls answered with a 429
+FAKE_LATENCY = float(os.getenv("FAKE_AI_LATENCY", "0.5"))
+FAKE_EMBED_LATENCY = float(os.getenv("FAKE_AI_EMBED_LATENCY", "0.05"))
+FAKE_429_RATE = float(os.getenv("FAKE_AI_429_RATE", "0"))
+FAKE_SEED = int(os.getenv("FAKE_AI_SEED", "0"))
+
+class GeminiProvider:
+    """
+    google.generativeai bound to one API key. genai.configure() swaps a
+    process-wide client, so each provider builds its own GenerativeService
+    client once and hands it to the models and embed calls it makes.
+    That goes through genai_client._ClientManager and model._client, which
+    are private: requirements.txt pins the google-generativeai release this
+    was verified against (0.8.6).
+    """
+    def __init__(self, api_key):
+        manager = genai_client._ClientManager()
+        manager.configure(api_key=api_key)
+        self._client = manager.get_default_client("generative")
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, model_name):
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                model._client = self._client
+                self._models[model_name] = model
+            return model
+
+    def generate(self, model_name, contents, response_schema=None):
+        """Return the response text. With response_schema the answer is schema-constrained JSON."""
+        config = None
+        if response_schema is not None:
+            config = genai.GenerationConfig(response_mime_type="application/json", response_schema=response_schema)
+        return self._model(model_name).generate_content(contents, generation_config=config).text
+
+    def embed(self, texts, model_name, task_type="retrieval_query"):
+        res = genai.embed_content(model=model_name, content=list(texts), task_type=task_type, client=self._client)
+        return res["embedding"]
+
+# Dishes the fake "sees" in a photo, picked deterministically from the image bytes
+FAKE_DISHES = ["chicken rice", "fried egg", "kopi", "laksa", "char kway teow", "nasi lemak", "teh tarik", "roti prata"]
+
+class FakeProvider:
+    """
+    Deterministic offline provider. Answers every prompt the pipeline sends
+    (detection, label check, judge, single call, daily summary) with
+    well-formed output, sleeps `latency` seconds per call and fails a seeded
+    `rate_429` fraction of calls with a ResourceExhausted, like the real API.
+    """
+    def __init__(self, seed=FAKE_SEED, latency=FAKE_LATENCY, embed_latency=FAKE_EMBED_LATENCY,
+                 rate_429=FAKE_429_RATE, dim=768):
+        self.latency = latency
+        self.embed_latency = embed_latency
+        self.rate_429 = rate_429
+        self.dim = dim
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, latency):
+        with self._lock:
+            throttled = self._rng.random() < self.rate_429
+        time.sleep(latency)
+        if throttled:
+            raise api_exceptions.ResourceExhausted("Fake quota exceeded. Please retry in 1s.")
+
+    def generate(self, model_name, contents, response_schema=None):
+        self._call(self.latency)
+        prompt = contents[0] if isinstance(contents[0], str) else ""
+        images = [part["data"] for part in contents[1:] if isinstance(part, dict)]
+        items = self._visible_items(prompt, images)
+
+        if "Nutrition Coach" in prompt:
+            return "Solid day. Protein is on track; swap the sweetened drink for kopi-o kosong to trim ~80 kcal."
+        if "LABEL_FOUND" in prompt:
+            return "LABEL_FOUND: NO\nITEMS: " + ", ".join(items)
+        if response_schema is not None and "food_summary" not in json.dumps(response_schema):
+            return json.dumps({"items": items})
+
+        packed = self._packed_candidates(prompt)
+        judged = []
+        for entry in packed.get("items") or [{"query": item, "crIds": []} for item in items]:
+            est = self._stable_int(entry["query"], 80, 700)
+            judged.append({
+                "name": entry["query"],
+                "crId": entry["crIds"][0] if entry.get("crIds") else None,
+                "portion": 1.0,
+                "unit": "serving",
+                "est_cal": est, "est_p": est // 25, "est_c": est // 8, "est_f": est // 30,
+            })
+        result = {"food_summary": " & ".join(i["name"].title() for i in judged) or "Unknown", "label_found": False, "items": judged}
+        return json.dumps(result)
+
+    def embed(self, texts, model_name, task_type="retrieval_query"):
+        self._call(self.embed_latency)
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(" ".join(str(text).lower().split()).encode("utf-8")).digest()[:8], "little")
+            vec = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            vectors.append((vec / np.linalg.norm(vec)).tolist())
+        return vectors
+
+    def _visible_items(self, prompt, images):
+        match = re.search(r"User description:\s*(.+)", prompt, re.IGNORECASE)
+        if match and match.group(1).strip() not in ("", "None"):
+            parts = re.split(r",|;|\band\b|\bwith\b|\+", match.group(1), flags=re.IGNORECASE)
+            items = [p.strip() for p in parts if len(p.strip()) > 1]
+            if items:
+                return items
+        digest = hashlib.sha256(b"".join(images) or prompt.encode("utf-8")).digest()
+        return [FAKE_DISHES[digest[0] % len(FAKE_DISHES)], FAKE_DISHES[digest[1] % len(FAKE_DISHES)]]
+
+    @staticmethod
+    def _packed_candidates(prompt):
+        start = prompt.find('{"items":')
+        if start == -1:
+            return {}
+        try:
+            return json.JSONDecoder().raw_decode(prompt[start:])[0]
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _stable_int(text, low, high):
+        digest = hashlib.sha256(text.lower().encode("utf-8")).digest()
+        return low + int.from_bytes(digest[:4], "little") % (high - low)
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def get_provider(key_index, api_key=None):
+    """One reusable provider per API key slot."""
+    with _providers_lock:
+        provider = _providers.get(key_index)
+        if provider is None:
+            if AI_PROVIDER == "fake":
+                provider = FakeProvider(seed=FAKE_SEED + key_index)
+            else:
+                provider = GeminiProvider(api_key)
+            _providers[key_index] = provider
+        return provider
@@ -0,0 +1,130 @@
+import os
+import queue
+import threading
+import json
+import logging
+import database
+import ai_engine
+import key_scheduler
+import meal_stats
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool of background analysis workers
+QUEUE_WORKERS = int(os.getenv("ANALYSIS_QUEUE_WORKERS", "2"))
+# Floor on the re-queue delay when every key/model pair is throttled
+RETRY_MIN_DELAY = float(os.getenv("ANALYSIS_QUEUE_RETRY_DELAY", "30"))
+# A meal whose analysis was started this many times without finishing (the process
+# died mid-run, e.g. on an image that crashes the worker) is marked failed
+MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))
+
+_jobs = queue.Queue()
+_workers = []
+_workers_lock = threading.Lock()
+
+def enqueue(meal_id):
+    """Queue a pending meal for background analysis."""
+    start_workers()
+    _jobs.put(meal_id)
+
+def start_workers():
+    with _workers_lock:
+        while len(_workers) < QUEUE_WORKERS:
+            worker = threading.Thread(target=_worker_loop, name=f"analysis-queue-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+def resume_pending():
+    """
+    Crash-safe resumption: re-queue every meal that was still pending or
+    mid-analysis when the process last stopped. Called at startup. Meals that
+    keep getting interrupted are failed by process_meal after MAX_ATTEMPTS.
+    """
+    db = database.SessionLocal()
+    try:
+        meal_ids = [m.id for m in db.query(database.Meal.id).filter(
+            database.Meal.status.in_(["pending", "processing"])
+        ).order_by(database.Meal.id).all()]
+    finally:
+        db.close()
+    for meal_id in meal_ids:
+        enqueue(meal_id)
+    if meal_ids:
+        logger.info(f"Resumed {len(meal_ids)} pending meal analyses")
+    return len(meal_ids)
+
+def _worker_loop():
+    while True:
+        meal_id = _jobs.get()
+        try:
+            process_meal(meal_id)
+        except Exception:
+            logger.exception(f"Unhandled error analysing meal {meal_id}")
+        finally:
+            _jobs.task_done()
+
+def process_meal(meal_id):
+    """Run the AI pipeline for a pending meal and fill in its macros."""
+    db = database.SessionLocal()
+    try:
+        meal = db.query(database.Meal).filter(database.Meal.id == meal_id).first()
+        if not meal or meal.status not in ("pending", "processing"):
+            return
+        if (meal.analysis_attempts or 0) >= MAX_ATTEMPTS:
+            logger.error(f"Giving up on meal {meal_id} after {meal.analysis_attempts} interrupted analyses")
+            meal.status = "failed"
+            meal.analysis_error = f"Analysis did not finish after {meal.analysis_attempts} attempts"
+            meal_stats.mark_changed(db, meal.user_id, meal.timestamp.date().isoformat())
+            db.commit()
+            return
+        # Committed before the pipeline runs, so a crash mid-analysis still counts
+        meal.analysis_attempts = (meal.analysis_attempts or 0) + 1
+        if meal.status != "processing":
+            meal.status = "processing"
+            meal_stats.mark_changed(db, meal.user_id, meal.timestamp.date().isoformat())
+        db.commit()
+
+        image_paths = json.loads(meal.image_paths) if meal.image_paths else []
+        try:
+            food_name, cals, p, c, f, items = ai_engine.estimate_calories(image_paths or None, meal.description)
+        except key_scheduler.QuotaExhausted as e:
+            # Quota events are temporary: keep the meal pending and retry once a breaker reopens
+            delay = max(e.retry_after or 0, RETRY_MIN_DELAY)
+            logger.warning(f"AI quota reached, retrying meal {meal_id} in {delay:.0f}s")
+            meal.status = "pending"
+            # The attempt finished cleanly; waiting out a quota is not a crash
+            meal.analysis_attempts = 0
+            meal_stats.mark_changed(db, meal.user_id, meal.timestamp.date().isoformat())
+            db.commit()
+            timer = threading.Timer(delay, enqueue, args=(meal_id,))
+            timer.daemon = True
+            timer.start()
+            return
+        except Exception as e:
+            logger.exception(f"Background analysis failed for meal {meal_id}")
+            meal.status = "failed"
+            meal.analysis_error = str(e)
+            meal_stats.mark_changed(db, meal.user_id, meal.timestamp.date().isoformat())
+            db.commit()
+            return
+
+        meal.food_name = food_name
+        meal.calories = int(cals)
+        meal.protein = int(p)
+        meal.carbs = int(c)
+        meal.fat = int(f)
+        meal.items_json = json.dumps(items)
+        meal.status = "done"
+        meal.analysis_error = None
+
+        # Clear the persistent summary for that day so it regenerates with the new data
+        db.query(database.DailySummary).filter(
+            database.DailySummary.user_id == meal.user_id,
+            database.DailySummary.date == meal.timestamp.date().isoformat()
+        ).delete()
+        meal_stats.refresh_day(db, meal.user_id, meal.timestamp.date())
+        meal.owner.cached_summary = None
+        db.commit()
+        logger.info(f"Background analysis finished for meal {meal_id}")
+    finally:
+        db.close()
@@ -1,5 +1,6 @@
 import database
 import ai_engine
+import meal_stats
 from sqlalchemy.orm import Session
 from itertools import groupby
 import logging
@@ -46,6 +47,7 @@ def backfill_summaries():
                             content=new_summary_text
                         )
                         db.add(new_summary)
+                    meal_stats.mark_changed(db, user.id, date_str)
                     
                     db.commit()
                     logging.info(f"    ✓ Updated.")
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import statistics
+
+# Run against a throwaway database/uploads dir: database.py and main.py use cwd-relative paths
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(tempfile.mkdtemp(prefix="fuel-bench-"))
+os.makedirs("uploads", exist_ok=True)
+
+import httpx
+import database
+import ai_engine
+import auth
+import main
+
+def fake_analysis(latency):
+    def estimate_calories(image_paths=None, user_description=None, use_cache=True):
+        time.sleep(latency)  # Stands in for the blocking Gemini / HPB round trips
+        return "Chicken Rice", 600, 30, 70, 20, [{"name": "Chicken Rice", "portion": 1.0, "cal": 600}]
+    return estimate_calories
+
+def make_user():
+    db = database.SessionLocal()
+    try:
+        user = database.User(email="bench@example.com", hashed_password="x", name="Bench", is_verified=1)
+        db.add(user)
+        db.commit()
+    finally:
+        db.close()
+    return auth.create_access_token(data={"sub": "bench@example.com"})
+
+async def run(mode, uploads, polls, latency):
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    if mode == "blocking":
+        # Previous behaviour: the pipeline ran directly on the event loop
+        async def inline(image_paths, description, use_cache=True):
+            return ai_engine.estimate_calories(image_paths, description, use_cache=use_cache)
+        main.run_analysis = inline
+    else:
+        main.run_analysis = ORIGINAL_RUN_ANALYSIS
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def upload():
+            await client.post("/upload-meal", data={"description": "chicken rice"}, headers=headers)
+
+        async def poll():
+            samples = []
+            await asyncio.sleep(0.05)  # Let the uploads start first
+            for _ in range(polls):
+                started = time.perf_counter()
+                await client.get("/stats", headers=headers)
+                samples.append(time.perf_counter() - started)
+                await asyncio.sleep(0.05)
+            return samples
+
+        started = time.perf_counter()
+        results = await asyncio.gather(poll(), *[upload() for _ in range(uploads)])
+        wall = time.perf_counter() - started
+
+    samples = sorted(results[0])
+    p50 = statistics.median(samples) * 1000
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+    print(f"{mode:<9} uploads={uploads} wall {wall:6.2f}s  concurrent request p50 {p50:8.1f} ms  p99/max {p99:8.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency of unrelated requests while uploads are being analysed")
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--polls", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=2.0, help="simulated seconds per analysis")
+    args = parser.parse_args()
+
+    ai_engine.estimate_calories = fake_analysis(args.latency)
+    ai_engine.generate_daily_summary = lambda meals, target: "Bench summary"
+    ORIGINAL_RUN_ANALYSIS = main.run_analysis
+    TOKEN = make_user()
+
+    for mode in ("blocking", "executor"):
+        asyncio.run(run(mode, args.uploads, args.polls, args.latency))
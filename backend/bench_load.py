@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import io
+import itertools
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline load test: fake Gemini provider + fake HPB portal, throwaway database/uploads dir.
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Throughput and tail latency of estimate_calories and the upload endpoints under N concurrent users")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16], help="concurrency levels to run")
+    parser.add_argument("--requests", type=int, default=5, help="meals per user per level")
+    parser.add_argument("--target", choices=["engine", "http", "http-async", "all"], default="all")
+    parser.add_argument("--mode", choices=["multipass", "single"], default=None, help="pipeline mode (default PIPELINE_MODE)")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake seconds per generate call")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of fake calls answered with a 429")
+    parser.add_argument("--hpb-latency", type=float, default=0.3, help="fake HPB portal seconds per request")
+    parser.add_argument("--hpb-error-rate", type=float, default=0.0)
+    parser.add_argument("--catalog", help="existing calorie_tracker.db with the HPB tables, copied in so retrieval has candidates")
+    return parser.parse_args()
+
+ARGS = parse_args()
+os.environ["AI_PROVIDER"] = "fake"
+os.environ["FAKE_AI_LATENCY"] = str(ARGS.latency)
+os.environ["FAKE_AI_429_RATE"] = str(ARGS.rate_429)
+# Benchmarks measure steady state, not a scheduler that gave up after the first 429 burst
+os.environ.setdefault("GEMINI_COOLDOWN_SECONDS", "1")
+
+CATALOG = os.path.abspath(ARGS.catalog) if ARGS.catalog else None
+os.chdir(tempfile.mkdtemp(prefix="fuel-load-"))
+os.makedirs("uploads", exist_ok=True)
+if CATALOG:
+    shutil.copy(CATALOG, "calorie_tracker.db")
+
+import fake_hpb
+HPB_SERVER = fake_hpb.start(latency=ARGS.hpb_latency, error_rate=ARGS.hpb_error_rate)
+os.environ["HPB_API_BASE"] = f"http://127.0.0.1:{HPB_SERVER.server_address[1]}"
+
+import httpx
+import numpy as np
+from PIL import Image
+import ai_engine
+import analysis_queue
+import auth
+import database
+import key_scheduler
+import main
+import metrics
+
+_image_seq = itertools.count()
+
+def make_image():
+    """A distinct JPEG per meal so neither the result cache nor thumbnails short-circuit."""
+    pixels = np.random.default_rng(next(_image_seq)).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).resize((640, 480)).save(buf, "JPEG")
+    return buf.getvalue()
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def report(target, users, wall, latencies, outcomes):
+    done = len(latencies)
+    line = f"{target:<10} users={users:<3} meals={done:<4} wall {wall:6.2f}s  {done / wall:6.2f} meals/s"
+    if latencies:
+        line += (f"  p50 {statistics.median(latencies):6.2f}s  p95 {percentile(latencies, 0.95):6.2f}s"
+                 f"  p99 {percentile(latencies, 0.99):6.2f}s  max {max(latencies):6.2f}s")
+    print(line + "  " + " ".join(f"{k}={v}" for k, v in sorted(outcomes.items())))
+
+def bench_engine(users):
+    paths = []
+    for i in range(users * ARGS.requests):
+        path = os.path.join("uploads", f"engine_{users}_{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(make_image())
+        paths.append(path)
+
+    def one(path):
+        started = time.perf_counter()
+        try:
+            food = ai_engine.estimate_calories([path], "chicken rice and kopi", use_cache=False, mode=ARGS.mode)[0]
+            outcome = "unknown" if food == "Unknown" else "ok"
+        except key_scheduler.QuotaExhausted:
+            outcome = "quota"
+        return time.perf_counter() - started, outcome
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        results = list(pool.map(one, paths))
+    wall = time.perf_counter() - started
+    outcomes = {}
+    for _, outcome in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    report("engine", users, wall, [lat for lat, outcome in results if outcome == "ok"], outcomes)
+
+def make_users(count):
+    db = database.SessionLocal()
+    tokens = []
+    try:
+        for i in range(count):
+            email = f"load{i}@example.com"
+            if not db.query(database.User).filter(database.User.email == email).first():
+                db.add(database.User(email=email, hashed_password="x", name=f"Load {i}", is_verified=1))
+            tokens.append(auth.create_access_token(data={"sub": email}))
+        db.commit()
+    finally:
+        db.close()
+    return tokens
+
+async def bench_http(users, async_mode):
+    tokens = make_users(users)
+    latencies, outcomes = [], {}
+    counter = iter(range(10 ** 9))
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def user(token):
+            headers = {"Authorization": f"Bearer {token}"}
+            for _ in range(ARGS.requests):
+                i = next(counter)
+                started = time.perf_counter()
+                resp = await client.post(
+                    "/upload-meal",
+                    data={"description": "chicken rice and kopi", "async_mode": str(async_mode).lower()},
+                    files={"files": (f"load_{users}_{i}.jpg", make_image(), "image/jpeg")},
+                    headers=headers,
+                )
+                outcome = str(resp.status_code)
+                if async_mode and resp.status_code == 202:
+                    # Time to a finished analysis, not just to the 202
+                    status_url = resp.json()["status_url"]
+                    while True:
+                        await asyncio.sleep(0.05)
+                        state = (await client.get(status_url, headers=headers)).json().get("status")
+                        if state in ("done", "failed"):
+                            outcome = state
+                            break
+                if outcome in ("200", "done"):
+                    latencies.append(time.perf_counter() - started)
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[user(token) for token in tokens])
+        wall = time.perf_counter() - started
+    report("http-async" if async_mode else "http", users, wall, latencies, outcomes)
+
+def counter_total(name):
+    return sum(value for (n, _), value in metrics._counters.items() if n == name)
+
+if __name__ == "__main__":
+    ai_engine.generate_daily_summary = lambda meals, target: "Load test summary"
+    print(f"fake Gemini {ARGS.latency}s/call, 429 rate {ARGS.rate_429:.0%}; fake HPB {ARGS.hpb_latency}s/request; "
+          f"ANALYSIS_WORKERS={main.ANALYSIS_WORKERS} ANALYSIS_QUEUE_WORKERS={analysis_queue.QUEUE_WORKERS}")
+    for users in ARGS.users:
+        if ARGS.target in ("engine", "all"):
+            bench_engine(users)
+        if ARGS.target in ("http", "all"):
+            asyncio.run(bench_http(users, async_mode=False))
+        if ARGS.target in ("http-async", "all"):
+            asyncio.run(bench_http(users, async_mode=True))
+    print(f"Gemini attempts {counter_total('fuel_gemini_calls_total')}, 429s {counter_total('fuel_gemini_rate_limited_total')}, "
+          f"HPB lookups {counter_total('fuel_hpb_nutrient_lookups_total')}")
@@ -0,0 +1,66 @@
+import argparse
+import json
+import os
+import statistics
+import time
+import ai_engine
+
+def count_model_calls():
+    """Wrap every provider's generate so each run can report its round trips."""
+    counter = {"calls": 0}
+
+    def wrap(provider_cls):
+        original = provider_cls.generate
+
+        def counted(self, *args, **kwargs):
+            counter["calls"] += 1
+            return original(self, *args, **kwargs)
+
+        provider_cls.generate = counted
+
+    for provider_cls in (ai_engine.ai_providers.GeminiProvider, ai_engine.ai_providers.FakeProvider):
+        wrap(provider_cls)
+    return counter
+
+def run_samples(samples, mode, counter):
+    rows = []
+    for sample in samples:
+        counter["calls"] = 0
+        started = time.perf_counter()
+        food, cals, p, c, f, items = ai_engine.estimate_calories(
+            sample.get("images") or None, sample.get("description"), use_cache=False, mode=mode
+        )
+        elapsed = time.perf_counter() - started
+        expected = sample.get("expected_calories")
+        error = abs(cals - expected) / expected if expected else None
+        rows.append({"name": sample.get("name", food), "latency": elapsed, "calls": counter["calls"],
+                     "calories": cals, "expected": expected, "error": error, "items": len(items)})
+    return rows
+
+def summarize(mode, rows):
+    latencies = sorted(r["latency"] for r in rows)
+    errors = [r["error"] for r in rows if r["error"] is not None]
+    print(f"\n== {mode} ==")
+    for r in rows:
+        err = f"{r['error'] * 100:5.1f}%" if r["error"] is not None else "   n/a"
+        print(f"  {r['name'][:32]:<32} {r['latency']:6.2f}s  calls={r['calls']}  kcal={r['calories']:<5} expected={r['expected']}  err={err}  items={r['items']}")
+    print(f"  latency mean {statistics.mean(latencies):.2f}s  p50 {statistics.median(latencies):.2f}s  max {latencies[-1]:.2f}s")
+    print(f"  model calls/meal {statistics.mean(r['calls'] for r in rows):.1f}")
+    if errors:
+        print(f"  calorie MAPE {statistics.mean(errors) * 100:.1f}%  (n={len(errors)})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Side-by-side latency/accuracy of the multipass and single-call pipelines")
+    parser.add_argument("manifest", help='JSON list of {"name", "images": [...], "description", "expected_calories"}')
+    parser.add_argument("--modes", nargs="+", default=["multipass", "single"])
+    args = parser.parse_args()
+
+    with open(args.manifest, "r") as f:
+        samples = json.load(f)
+    base = os.path.dirname(os.path.abspath(args.manifest))
+    for sample in samples:
+        sample["images"] = [p if os.path.isabs(p) else os.path.join(base, p) for p in sample.get("images", [])]
+
+    counter = count_model_calls()
+    for mode in args.modes:
+        summarize(mode, run_samples(samples, mode, counter))
@@ -0,0 +1,62 @@
+import argparse
+import time
+import numpy as np
+import hpb_index
+
+def synthetic_catalogue(n, dim=768, clusters=500, seed=0):
+    """Clustered random unit vectors, roughly shaped like a food catalogue."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    matrix = centres[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+def run(matrix, n_queries, k, nprobes, n_lists, seed=1):
+    rows = [{"name": str(i), "crId": str(i), "desc": "", "unit": "unit", "weight": 0} for i in range(len(matrix))]
+    rng = np.random.default_rng(seed)
+    # Queries are perturbed catalogue rows, like "chicken rice" vs "Chicken rice, roasted"
+    picks = rng.integers(0, len(matrix), n_queries)
+    queries = matrix[picks] + 0.05 * rng.standard_normal((n_queries, matrix.shape[1])).astype(np.float32)
+
+    exact = hpb_index.HPBEmbeddingIndex.from_matrix(matrix, rows)
+    truth, exact_times = [], []
+    for q in queries:
+        started = time.perf_counter()
+        res = exact.search(q, limit=k)
+        exact_times.append(time.perf_counter() - started)
+        truth.append({r["crId"] for r in res})
+    print(f"exact          p50 {percentile_ms(exact_times, 50):7.2f} ms  p99 {percentile_ms(exact_times, 99):7.2f} ms")
+
+    started = time.perf_counter()
+    ivf = hpb_index.IVFIndex.build(matrix, n_lists=n_lists)
+    print(f"IVF build: {len(ivf.centroids)} lists in {time.perf_counter() - started:.1f}s")
+
+    for nprobe in nprobes:
+        approx = hpb_index.HPBEmbeddingIndex.from_matrix(matrix, rows, backend="ivf", ivf=ivf, nprobe=nprobe)
+        hits, times = 0, []
+        for q, expected in zip(queries, truth):
+            started = time.perf_counter()
+            res = approx.search(q, limit=k)
+            times.append(time.perf_counter() - started)
+            hits += len(expected & {r["crId"] for r in res})
+        recall = hits / (k * len(queries))
+        print(f"ivf nprobe={nprobe:<3} p50 {percentile_ms(times, 50):7.2f} ms  p99 {percentile_ms(times, 99):7.2f} ms  recall@{k} {recall:.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall and latency of IVF vs exact HPB retrieval")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark N synthetic vectors instead of the DB")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    if args.synthetic:
+        matrix = synthetic_catalogue(args.synthetic)
+    else:
+        _, _, matrix = hpb_index.load_matrix()
+    print(f"Catalogue: {matrix.shape[0]} vectors x {matrix.shape[1]} dims, {args.queries} queries")
+    run(matrix, args.queries, args.k, args.nprobe, args.lists)
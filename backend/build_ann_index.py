@@ -0,0 +1,25 @@
+import time
+import hpb_index
+
+# Configuration
+DB_PATH = "calorie_tracker.db"
+
+def build_ann_index(n_lists=None):
+    """
+    Build the IVF (k-means) ANN index over hpb_embeddings and persist it to
+    hpb_ivf.npz. Enable it at runtime with HPB_ANN_BACKEND=ivf.
+    """
+    fingerprint, crIds, matrix = hpb_index.load_matrix(DB_PATH)
+    if not crIds:
+        print("No embeddings found. Run generate_embeddings.py first.")
+        return
+
+    print(f"Clustering {len(crIds)} vectors...")
+    started = time.perf_counter()
+    ivf = hpb_index.IVFIndex.build(matrix, n_lists=n_lists)
+    ivf.save(hpb_index.IVF_PATH, fingerprint, crIds)
+    print(f"✓ Wrote {hpb_index.IVF_PATH} ({len(ivf.centroids)} lists) in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    import sys
+    build_ann_index(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,78 @@
+import json
+import os
+
+# Candidate packing for the judge prompt
+MAX_CANDIDATES = int(os.getenv("JUDGE_MAX_CANDIDATES", "10"))
+MIN_CANDIDATES = int(os.getenv("JUDGE_MIN_CANDIDATES", "3"))
+# Cut the tail at the biggest score drop if it is this many times the mean drop
+GAP_RATIO = float(os.getenv("JUDGE_SCORE_GAP_RATIO", "2.5"))
+DESC_MAX_CHARS = int(os.getenv("JUDGE_DESC_MAX_CHARS", "80"))
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) for logging prompt size."""
+    return (len(text) + 3) // 4
+
+def trim_by_score_gap(candidates):
+    """
+    Keep the head of a best-first candidate list: everything before the
+    largest score drop, provided that drop clearly stands out.
+    """
+    candidates = candidates[:MAX_CANDIDATES]
+    if len(candidates) <= MIN_CANDIDATES or any("score" not in c for c in candidates):
+        return candidates
+    scores = [c["score"] for c in candidates]
+    gaps = [scores[i] - scores[i + 1] for i in range(len(scores) - 1)]
+    mean_gap = sum(gaps) / len(gaps)
+    cut, biggest = None, 0
+    for i in range(MIN_CANDIDATES - 1, len(gaps)):
+        if gaps[i] > biggest:
+            cut, biggest = i + 1, gaps[i]
+    if cut is not None and mean_gap > 0 and biggest > GAP_RATIO * mean_gap:
+        return candidates[:cut]
+    return candidates
+
+def truncate_desc(desc, name):
+    if not desc or desc.strip().lower() == (name or "").strip().lower():
+        return None
+    desc = " ".join(desc.split())
+    if len(desc) <= DESC_MAX_CHARS:
+        return desc
+    return desc[:DESC_MAX_CHARS].rsplit(" ", 1)[0] + "…"
+
+def pack_candidates(matches):
+    """
+    matches: [{"query": str, "candidates": [semantic candidate dicts]}].
+    Returns {"items": [{"query", "crIds": [...]}], "reference": {crId: {name, unit, desc}}}
+    so a food shared by several items is described only once.
+    """
+    reference = {}
+    items = []
+    for match in matches:
+        crIds = []
+        for c in trim_by_score_gap(match["candidates"]):
+            if c["crId"] not in reference:
+                entry = {"name": c["name"], "unit": c.get("unit", "unit")}
+                desc = truncate_desc(c.get("desc"), c["name"])
+                if desc:
+                    entry["desc"] = desc
+                reference[c["crId"]] = entry
+            if c["crId"] not in crIds:
+                crIds.append(c["crId"])
+        items.append({"query": match["query"], "crIds": crIds})
+    return {"items": items, "reference": reference}
+
+def render(matches):
+    """
+    Compact JSON for the judge prompt. Logs the candidate block's estimated
+    token count before (full per-item lists) and after packing.
+    """
+    before = json.dumps([
+        {"query": m["query"], "candidates": [
+            {"name": c["name"], "crId": c["crId"], "unit": c.get("unit", "unit"), "desc": c["desc"]}
+            for c in m["candidates"]
+        ]}
+        for m in matches
+    ])
+    packed = json.dumps(pack_candidates(matches), ensure_ascii=False, separators=(",", ":"))
+    print(f"Judge candidates: ~{estimate_tokens(before)} tokens before packing, ~{estimate_tokens(packed)} after")
+    return packed
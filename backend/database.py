@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -25,6 +25,8 @@ class User(Base):
     
     cached_summary = Column(String, nullable=True)
     summary_date = Column(String, nullable=True) # YYYY-MM-DD
+    # Bumped on every change to the user's meals, feedback, summaries or target
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")
     meals = relationship("Meal", back_populates="owner")
 
 class Meal(Base):
@@ -46,7 +48,18 @@ class Meal(Base):
     # New field for Trainer/Public comments
     trainer_notes = Column(String, nullable=True)
     
+    # Background analysis state: pending -> processing -> done / failed
+    status = Column(String, default="done")
+    analysis_error = Column(String, nullable=True)
+    # Analyses started but never finished (worker died mid-run); see analysis_queue.MAX_ATTEMPTS
+    analysis_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    
     owner = relationship("User", back_populates="meals")
+    
+    # Per-user range scans by time; the macro columns make day totals index-only
+    __table_args__ = (
+        Index("ix_meals_user_timestamp", "user_id", "timestamp", "calories", "protein", "carbs", "fat"),
+    )
 
 class DailyFeedback(Base):
     __tablename__ = "daily_feedback"
@@ -54,6 +67,8 @@ class DailyFeedback(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     date = Column(String, index=True) # YYYY-MM-DD
     content = Column(String, nullable=True)
+    
+    __table_args__ = (Index("ux_daily_feedback_user_date", "user_id", "date", unique=True),)
 
 class DailySummary(Base):
     __tablename__ = "daily_summaries"
@@ -61,8 +76,34 @@ class DailySummary(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     date = Column(String, index=True) # YYYY-MM-DD
     content = Column(String, nullable=True)
+    
+    __table_args__ = (Index("ux_daily_summaries_user_date", "user_id", "date", unique=True),)
+
+class DailyRollup(Base):
+    """Per-user, per-day meal totals, kept in step with meals by meal_stats.refresh_day."""
+    __tablename__ = "daily_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    date = Column(String) # YYYY-MM-DD
+    calories = Column(Integer, default=0)
+    protein = Column(Integer, default=0)
+    carbs = Column(Integer, default=0)
+    fat = Column(Integer, default=0)
+    meal_count = Column(Integer, default=0)
+    
+    __table_args__ = (Index("ux_daily_rollups_user_date", "user_id", "date", unique=True),)
+
+class ChangeLog(Base):
+    """One row per users.data_version bump: which day changed (NULL = not tied to a day)."""
+    __tablename__ = "change_log"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    version = Column(Integer)
+    date = Column(String, nullable=True) # YYYY-MM-DD
+    
+    __table_args__ = (Index("ix_change_log_user_version", "user_id", "version"),)
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -73,5 +114,143 @@ def get_db():
     finally:
         db.close()
 
+def _add_columns(conn, columns):
+    """create_all never alters existing tables: add any of {table: [(column, ddl type)]} that are missing."""
+    inspector = inspect(conn)
+    for table, table_columns in columns.items():
+        if not inspector.has_table(table):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        for name, ddl in table_columns:
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+# The model columns as of migration 1; frozen so the migration never changes after it has run
+_V1_COLUMNS = {
+    "users": [
+        ("telegram_id", "VARCHAR"), ("email", "VARCHAR"), ("hashed_password", "VARCHAR"), ("name", "VARCHAR"),
+        ("daily_target", "INTEGER DEFAULT 2000"), ("share_enabled", "INTEGER DEFAULT 0"), ("share_token", "VARCHAR"),
+        ("is_verified", "INTEGER DEFAULT 0"), ("verification_token", "VARCHAR"),
+        ("cached_summary", "VARCHAR"), ("summary_date", "VARCHAR"),
+    ],
+    "meals": [
+        ("user_id", "INTEGER"), ("food_name", "VARCHAR"), ("meal_type", "VARCHAR"), ("description", "VARCHAR"),
+        ("calories", "INTEGER"), ("protein", "INTEGER DEFAULT 0"), ("carbs", "INTEGER DEFAULT 0"),
+        ("fat", "INTEGER DEFAULT 0"), ("image_paths", "VARCHAR"), ("portion", "FLOAT DEFAULT 1.0"),
+        ("items_json", "VARCHAR"), ("timestamp", "DATETIME"), ("trainer_notes", "VARCHAR"),
+        ("status", "VARCHAR DEFAULT 'done'"), ("analysis_error", "VARCHAR"),
+    ],
+    "daily_feedback": [("user_id", "INTEGER"), ("date", "VARCHAR"), ("content", "VARCHAR")],
+    "daily_summaries": [("user_id", "INTEGER"), ("date", "VARCHAR"), ("content", "VARCHAR")],
+}
+
+def _add_missing_columns(conn):
+    _add_columns(conn, _V1_COLUMNS)
+
+def _add_data_version(conn):
+    _add_columns(conn, {"users": [("data_version", "INTEGER NOT NULL DEFAULT 0")]})
+
+def _add_meal_indexes(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_meals_user_timestamp "
+        "ON meals (user_id, timestamp, calories, protein, carbs, fat)"
+    ))
+
+def _unique_days(conn):
+    """One summary / one feedback row per user and day: drop duplicates (keep the newest), then enforce it."""
+    for table in ("daily_summaries", "daily_feedback"):
+        conn.execute(text(
+            f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY user_id, date)"
+        ))
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_user_date ON {table} (user_id, date)"
+        ))
+
+# Recompute daily_rollups rows from meals; callers add the WHERE clause
+ROLLUP_INSERT = """
+    INSERT INTO daily_rollups (user_id, date, calories, protein, carbs, fat, meal_count)
+    SELECT user_id, date(timestamp), COALESCE(SUM(calories), 0), COALESCE(SUM(protein), 0),
+           COALESCE(SUM(carbs), 0), COALESCE(SUM(fat), 0), COUNT(id)
+    FROM meals
+"""
+
+def _rebuild_rollup_rows(conn, user_id=None):
+    if user_id is None:
+        conn.execute(text("DELETE FROM daily_rollups"))
+        conn.execute(text(ROLLUP_INSERT + " GROUP BY user_id, date(timestamp)"))
+    else:
+        conn.execute(text("DELETE FROM daily_rollups WHERE user_id = :u"), {"u": user_id})
+        conn.execute(text(ROLLUP_INSERT + " WHERE user_id = :u GROUP BY user_id, date(timestamp)"), {"u": user_id})
+
+def rebuild_daily_rollups(conn, user_id=None):
+    """
+    Rebuild daily_rollups from scratch (all users, or one), then bump each
+    affected user's data_version with a dateless change_log row, as
+    meal_stats.mark_changed does, so share_cache entries, ETags and
+    /stats/changes pollers pick up the recomputed totals.
+    """
+    _rebuild_rollup_rows(conn, user_id)
+    where, params = ("", {}) if user_id is None else (" WHERE id = :u", {"u": user_id})
+    conn.execute(text("UPDATE users SET data_version = COALESCE(data_version, 0) + 1" + where), params)
+    conn.execute(text("INSERT INTO change_log (user_id, version, date) SELECT id, data_version, NULL FROM users" + where), params)
+
+def _backfill_daily_rollups(conn):
+    """Create daily_rollups when create_all has not run yet, then fill it from meals."""
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS daily_rollups ("
+        "id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES users (id), date VARCHAR, "
+        "calories INTEGER, protein INTEGER, carbs INTEGER, fat INTEGER, meal_count INTEGER)"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_daily_rollups_id ON daily_rollups (id)"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_daily_rollups_user_date ON daily_rollups (user_id, date)"
+    ))
+    # Rows only: data_version and change_log arrive in later migrations
+    _rebuild_rollup_rows(conn)
+
+def _create_change_log(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS change_log ("
+        "id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES users (id), version INTEGER, date VARCHAR)"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_change_log_id ON change_log (id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_change_log_user_version ON change_log (user_id, version)"))
+
+def _add_analysis_attempts(conn):
+    _add_columns(conn, {"meals": [("analysis_attempts", "INTEGER NOT NULL DEFAULT 0")]})
+
+# Versioned migrations, applied once each, in order, at startup. Append new
+# ones; never edit or reorder applied entries. Each must also be safe on a
+# fresh database that create_all has just built.
+MIGRATIONS = [
+    (1, "add columns missing from older databases", _add_missing_columns),
+    (2, "composite (user_id, timestamp) index on meals", _add_meal_indexes),
+    (3, "unique (user_id, date) on daily_summaries and daily_feedback", _unique_days),
+    (4, "backfill daily_rollups from meals", _backfill_daily_rollups),
+    (5, "users.data_version change stamp", _add_data_version),
+    (6, "change_log for /stats/changes", _create_change_log),
+    (7, "meals.analysis_attempts", _add_analysis_attempts),
+]
+
+def run_migrations():
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name TEXT, applied_at DATETIME)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        # Each migration commits together with its version row, or not at all
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow()}
+            )
+        print(f"Applied schema migration {version}: {name}")
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    run_migrations()
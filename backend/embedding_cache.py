@@ -0,0 +1,114 @@
+import sqlite3
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import hpb_index
+import metrics
+
+# Configuration
+DB_PATH = "calorie_tracker.db"
+# Tier 1: in-process LRU size (entries). Tier 2 is the query_embeddings table.
+LRU_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+
+_lru = OrderedDict()
+_lock = threading.Lock()
+_table_ready = False
+
+# Hit/miss counters, read via get_stats()
+stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+def normalize_query(text):
+    """'  White  Rice ' and 'white rice' share one cache entry."""
+    return " ".join(str(text).lower().split())
+
+def _connect():
+    global _table_ready
+    conn = sqlite3.connect(DB_PATH)
+    if not _table_ready:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                model TEXT NOT NULL,
+                query TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                created_at REAL,
+                PRIMARY KEY (model, query)
+            )
+        """)
+        conn.commit()
+        _table_ready = True
+    return conn
+
+def _remember(key, vec):
+    with _lock:
+        _lru[key] = vec
+        _lru.move_to_end(key)
+        while len(_lru) > LRU_SIZE:
+            _lru.popitem(last=False)
+
+def get(query, model=hpb_index.EMBEDDING_MODEL):
+    """Return the cached float32 embedding for query, or None."""
+    key = (model, normalize_query(query))
+    with _lock:
+        vec = _lru.get(key)
+        if vec is not None:
+            _lru.move_to_end(key)
+            stats["memory_hits"] += 1
+            return vec
+
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                "SELECT embedding FROM query_embeddings WHERE model = ? AND query = ?", key
+            ).fetchone()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Query embedding cache read error: {e}")
+        row = None
+
+    if row:
+        vec, _ = hpb_index.decode_embedding(row[0])
+        _remember(key, vec)
+        with _lock:
+            stats["disk_hits"] += 1
+        return vec
+
+    with _lock:
+        stats["misses"] += 1
+    return None
+
+def put(query, vec, model=hpb_index.EMBEDDING_MODEL):
+    """Store an embedding in both tiers."""
+    key = (model, normalize_query(query))
+    vec = np.asarray(vec, dtype=np.float32)
+    _remember(key, vec)
+    try:
+        conn = _connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model, query, embedding, created_at) VALUES (?, ?, ?, ?)",
+                (key[0], key[1], hpb_index.encode_embedding(vec, model), time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Query embedding cache write error: {e}")
+
+def get_stats():
+    with _lock:
+        return dict(stats, memory_entries=len(_lru))
+
+def _collect():
+    current = get_stats()
+    return [
+        ("fuel_embedding_cache_total", "counter", "Query embedding cache lookups by outcome",
+         [({"result": name}, current[name]) for name in ("memory_hits", "disk_hits", "misses")]),
+        ("fuel_embedding_cache_entries", "gauge", "Entries in the in-process query embedding LRU",
+         [({}, current["memory_entries"])]),
+    ]
+
+metrics.register_collector(_collect)
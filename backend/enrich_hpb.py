@@ -2,6 +2,7 @@ import requests
 import sqlite3
 import time
 import re
+import hpb_nutrients
 
 DB_PATH = "calorie_tracker.db"
 HPB_DETAILS_URL = "https://pphtpc.hpb.gov.sg/bff/v1/food-portal/foods/details/{crId}"
@@ -58,6 +59,9 @@ def enrich_hpb_data():
                 weight = data.get("defaultWeight", 0)
                 unit = parse_portion_unit(raw_portion)
                 
+                # Seed the local nutrient store while we have the payload anyway
+                hpb_nutrients.store(crId, hpb_nutrients.parse_details(data))
+                
                 cursor.execute("""
                     UPDATE hpb_foods 
                     SET default_unit = ?, default_weight = ? 
@@ -0,0 +1,70 @@
+import argparse
+import re
+import sqlite3
+import database
+
+# The per-user access patterns behind /stats, history and summary invalidation
+HOT_QUERIES = {
+    "day totals": (
+        "SELECT date, calories, protein, carbs, fat, meal_count FROM daily_rollups "
+        "WHERE user_id = ? AND date >= ? AND date <= ? ORDER BY date DESC",
+        (1, "2024-01-01", "2024-01-31"),
+    ),
+    "refresh rollup": (
+        "SELECT user_id, date(timestamp), SUM(calories), SUM(protein), SUM(carbs), SUM(fat), COUNT(id) FROM meals "
+        "WHERE user_id = ? AND timestamp >= ? AND timestamp < ? GROUP BY user_id, date(timestamp)",
+        (1, "2024-01-31 00:00:00", "2024-02-01 00:00:00"),
+    ),
+    "history page": (
+        "SELECT * FROM daily_rollups WHERE user_id = ? AND meal_count > 0 AND date < ? ORDER BY date DESC, id DESC LIMIT ?",
+        (1, "2024-01-01", 8),
+    ),
+    "changes since": (
+        "SELECT version, date FROM change_log WHERE user_id = ? AND version > ?",
+        (1, 100),
+    ),
+    "meals in window": (
+        "SELECT * FROM meals WHERE user_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp DESC",
+        (1, "2024-01-24 00:00:00", "2024-01-31 00:00:00"),
+    ),
+    "summaries for days": (
+        "SELECT date, content FROM daily_summaries WHERE user_id = ? AND date IN (?, ?, ?)",
+        (1, "2024-01-29", "2024-01-30", "2024-01-31"),
+    ),
+    "feedback for days": (
+        "SELECT date, content FROM daily_feedback WHERE user_id = ? AND date IN (?, ?, ?)",
+        (1, "2024-01-29", "2024-01-30", "2024-01-31"),
+    ),
+    "invalidate summary": (
+        "DELETE FROM daily_summaries WHERE user_id = ? AND date = ?",
+        (1, "2024-01-31"),
+    ),
+}
+
+def print_plans(db_path, title):
+    print(f"== {title} ==")
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for name, (sql, params) in HOT_QUERIES.items():
+            print(f"{name}:")
+            # Tables added by later migrations don't exist on an older database yet
+            table = re.search(r"\bFROM\s+(\w+)", sql).group(1)
+            if table not in tables:
+                print(f"    {table}: table not present yet")
+                continue
+            for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+                print(f"    {row[-1]}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN for the hot per-user queries")
+    parser.add_argument("--migrate", action="store_true", help="apply pending schema migrations and show the plans again")
+    args = parser.parse_args()
+
+    db_path = database.engine.url.database
+    print_plans(db_path, "current schema")
+    if args.migrate:
+        database.run_migrations()
+        print_plans(db_path, "after migrations")
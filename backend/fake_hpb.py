@@ -0,0 +1,77 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Offline stand-in for the HPB food portal details endpoint. Point the app at it with
+# HPB_API_BASE=http://127.0.0.1:<port> (read when hpb_nutrients is imported).
+DETAILS_PATH = re.compile(r"^/bff/v1/food-portal/foods/details/([^/?]+)")
+
+def fake_details(crId):
+    """Deterministic nutrients for a crId, in the portal's payload shape."""
+    digest = hashlib.sha256(crId.encode("utf-8")).digest()
+    energy = 80 + int.from_bytes(digest[:2], "little") % 700
+    return {
+        "calculatedFoodNutrients": {
+            "energy": energy,
+            "protein": energy / 25,
+            "carbohydrate": energy / 8,
+            "fat": energy / 30,
+        },
+        "defaultPortion": ["1 plate(s) = 400g", "1 bowl(s) = 350g", "1 cup(s) = 250g", "1 piece(s) = 60g"][digest[2] % 4],
+    }
+
+def make_handler(latency, error_rate, seed):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        requests_served = 0
+
+        def do_GET(self):
+            with lock:
+                Handler.requests_served += 1
+                failed = rng.random() < error_rate
+            time.sleep(latency)
+            match = DETAILS_PATH.match(self.path)
+            if failed or not match:
+                status, body = (503 if failed else 404), b"{}"
+            else:
+                status, body = 200, json.dumps(fake_details(match.group(1))).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def start(port=0, latency=0.3, error_rate=0.0, seed=0):
+    """Serve in a daemon thread; returns the server (server.server_address has the bound port)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, error_rate, seed))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-hpb", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic offline HPB food portal")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    server = start(args.port, args.latency, args.error_rate)
+    print(f"Fake HPB portal on http://127.0.0.1:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,8 +1,8 @@
 import google.generativeai as genai
 import sqlite3
 import os
-import json
 import time
+import hpb_index
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,6 +14,12 @@ genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 def generate_and_store_embeddings():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hpb_embeddings (
+            crId TEXT PRIMARY KEY,
+            embedding BLOB
+        )
+    """)
     
     # 1. Get items that don't have embeddings yet
     cursor.execute("""
@@ -26,6 +32,7 @@ def generate_and_store_embeddings():
     
     if not rows:
         print("All items already have embeddings.")
+        conn.close()
         return
 
     print(f"Generating embeddings for {len(rows)} items...")
@@ -39,7 +46,7 @@ def generate_and_store_embeddings():
         
         try:
             result = genai.embed_content(
-                model="models/text-embedding-004",
+                model=hpb_index.EMBEDDING_MODEL,
                 content=texts,
                 task_type="retrieval_document"
             )
@@ -47,9 +54,9 @@ def generate_and_store_embeddings():
             embeddings = result['embedding']
             
             for crId, emb in zip(ids, embeddings):
-                # Store as JSON string or binary blob. JSON is easier to debug for now.
+                # Stored as little-endian float32 BLOB with a dim/model header
                 cursor.execute("INSERT INTO hpb_embeddings (crId, embedding) VALUES (?, ?)", 
-                             (crId, json.dumps(emb)))
+                             (crId, hpb_index.encode_embedding(emb)))
             
             conn.commit()
             print(f"  Processed {i + len(batch)}/{len(rows)}...")
@@ -60,7 +67,13 @@ def generate_and_store_embeddings():
             time.sleep(5)
             
     conn.close()
-    print("✓ Embedding generation complete.")
+    
+    # Refresh the memory-mapped sidecar so workers pick up the new rows
+    count = hpb_index.write_sidecar(DB_PATH)
+    if os.path.exists(hpb_index.IVF_PATH):
+        import build_ann_index
+        build_ann_index.build_ann_index()
+    print(f"✓ Embedding generation complete ({count} vectors in {hpb_index.SIDECAR_PATH}).")
 
 if __name__ == "__main__":
     generate_and_store_embeddings()
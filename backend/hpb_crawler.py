@@ -3,6 +3,7 @@ import sqlite3
 import time
 import math
 import logging
+import hpb_lexical
 
 # Configuration
 DB_PATH = "calorie_tracker.db"
@@ -28,6 +29,7 @@ def init_hpb_table():
             type TEXT
         )
     """)
+    hpb_lexical.create_fts(conn)
     conn.commit()
     conn.close()
 
@@ -47,6 +49,8 @@ def save_items(items):
             item.get('l2Category'),
             item.get('type')
         ))
+    # Keep the FTS5 lexical index in step with hpb_foods
+    hpb_lexical.sync_items(conn, items)
     conn.commit()
     conn.close()
 
@@ -0,0 +1,348 @@
+import sqlite3
+import json
+import os
+import struct
+import threading
+import time
+import numpy as np
+
+# Configuration
+DB_PATH = "calorie_tracker.db"
+EMBEDDING_MODEL = "models/text-embedding-004"
+# Memory-mapped sidecar: pre-normalized float32 matrix + crId order / fingerprint
+SIDECAR_PATH = "hpb_embeddings.npy"
+SIDECAR_META_PATH = "hpb_embeddings.meta.json"
+# How often (seconds) we check whether generate_embeddings.py added rows
+RELOAD_CHECK_INTERVAL = float(os.getenv("HPB_INDEX_RELOAD_INTERVAL", "30"))
+# Optional approximate search: "exact" scores every row, "ivf" probes the
+# nearest k-means clusters built offline by build_ann_index.py
+ANN_BACKEND = os.getenv("HPB_ANN_BACKEND", "exact")
+IVF_PATH = "hpb_ivf.npz"
+IVF_NPROBE = int(os.getenv("HPB_IVF_NPROBE", "8"))
+
+# Binary embedding format: magic, format version, dim, model name, then
+# `dim` little-endian float32 values.
+BLOB_MAGIC = b"HPBE"
+BLOB_VERSION = 1
+_BLOB_HEADER = struct.Struct("<4sBHB")
+
+def encode_embedding(vec, model=EMBEDDING_MODEL):
+    """Pack an embedding into the binary BLOB format stored in hpb_embeddings."""
+    data = np.asarray(vec, dtype="<f4")
+    model_bytes = model.encode("utf-8")
+    header = _BLOB_HEADER.pack(BLOB_MAGIC, BLOB_VERSION, data.shape[0], len(model_bytes))
+    return header + model_bytes + data.tobytes()
+
+def decode_embedding(value):
+    """Return (float32 vector, model) from a BLOB or a legacy JSON string."""
+    if isinstance(value, (bytes, memoryview)) and bytes(value[:4]) == BLOB_MAGIC:
+        magic, version, dim, model_len = _BLOB_HEADER.unpack_from(value)
+        if version != BLOB_VERSION:
+            raise ValueError(f"Unsupported embedding blob version {version}")
+        offset = _BLOB_HEADER.size
+        model = bytes(value[offset:offset + model_len]).decode("utf-8")
+        vec = np.frombuffer(value, dtype="<f4", count=dim, offset=offset + model_len)
+        return vec, model
+    # Legacy rows written by older generate_embeddings.py runs
+    return np.asarray(json.loads(value), dtype=np.float32), None
+
+def _read_fingerprint(conn):
+    # Row count + max rowid changes whenever embeddings are added or removed
+    return list(conn.execute("SELECT COUNT(*), MAX(rowid) FROM hpb_embeddings").fetchone())
+
+def _read_embeddings(conn):
+    """Decode every stored embedding. Returns (crIds, normalized float32 matrix)."""
+    crIds = []
+    vectors = []
+    dim = None
+    for crId, value in conn.execute("SELECT crId, embedding FROM hpb_embeddings ORDER BY rowid"):
+        vec, model = decode_embedding(value)
+        if model and model != EMBEDDING_MODEL:
+            continue
+        if dim is None:
+            dim = vec.shape[0]
+        elif vec.shape[0] != dim:
+            print(f"Skipping embedding for {crId}: dim {vec.shape[0]} != {dim}")
+            continue
+        crIds.append(crId)
+        vectors.append(vec)
+
+    if not vectors:
+        return crIds, np.zeros((0, 0), dtype=np.float32)
+
+    matrix = np.vstack(vectors).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return crIds, matrix
+
+def load_matrix(db_path=DB_PATH):
+    """Return (fingerprint, crIds, normalized matrix) straight from the database."""
+    conn = sqlite3.connect(db_path)
+    try:
+        fingerprint = _read_fingerprint(conn)
+        crIds, matrix = _read_embeddings(conn)
+    finally:
+        conn.close()
+    return fingerprint, crIds, matrix
+
+def write_sidecar(db_path=DB_PATH, path=SIDECAR_PATH, meta_path=SIDECAR_META_PATH):
+    """
+    Export hpb_embeddings to a memory-mappable .npy file so every worker
+    process maps the same pages instead of parsing its own copy.
+    """
+    fingerprint, crIds, matrix = load_matrix(db_path)
+
+    # Write to temp files first so a concurrently starting worker never maps a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, matrix)
+    tmp_meta = meta_path + ".tmp"
+    with open(tmp_meta, "w") as f:
+        json.dump({
+            "model": EMBEDDING_MODEL,
+            "dim": int(matrix.shape[1]) if matrix.size else 0,
+            "fingerprint": fingerprint,
+            "crIds": crIds
+        }, f)
+    os.replace(tmp_path, path)
+    os.replace(tmp_meta, meta_path)
+    return len(crIds)
+
+class IVFIndex:
+    """
+    Inverted-file ANN index: rows are bucketed by their nearest k-means
+    centroid, and a query only scores the rows of its `nprobe` closest lists.
+    """
+
+    def __init__(self, centroids, offsets, members):
+        self.centroids = centroids  # (n_lists, dim), unit rows
+        self.offsets = offsets      # list i holds members[offsets[i]:offsets[i + 1]]
+        self.members = members      # matrix row positions grouped by list
+
+    @classmethod
+    def build(cls, matrix, n_lists=None, iterations=20, seed=0):
+        """Spherical k-means over the (already normalized) matrix rows."""
+        n = matrix.shape[0]
+        n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        centroids = np.array(matrix[rng.choice(n, n_lists, replace=False)], dtype=np.float32)
+
+        assign = np.zeros(n, dtype=np.int64)
+        for _ in range(iterations):
+            assign = cls._assign(matrix, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, matrix)
+            counts = np.bincount(assign, minlength=n_lists)
+            # Re-seed empty lists with random rows so every list stays useful
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = matrix[rng.choice(n, int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        assign = cls._assign(matrix, centroids)
+        members = np.argsort(assign, kind="stable")
+        offsets = np.searchsorted(assign[members], np.arange(n_lists + 1))
+        return cls(centroids, offsets, members)
+
+    @staticmethod
+    def _assign(matrix, centroids, chunk=8192):
+        # Chunked so the (rows x lists) score block stays small on big catalogues
+        out = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], chunk):
+            out[start:start + chunk] = np.argmax(matrix[start:start + chunk] @ centroids.T, axis=1)
+        return out
+
+    def save(self, path, fingerprint, crIds):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, offsets=self.offsets, members=self.members,
+                 fingerprint=np.asarray(fingerprint, dtype=np.int64), n_rows=len(crIds))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, fingerprint, n_rows):
+        """Load a persisted index, or None if it was built from different rows."""
+        if not os.path.exists(path):
+            return None
+        try:
+            data = np.load(path)
+            if list(data["fingerprint"]) != list(fingerprint) or int(data["n_rows"]) != n_rows:
+                print("HPB IVF index is stale, using exact search. Re-run build_ann_index.py.")
+                return None
+            return cls(data["centroids"], data["offsets"], data["members"])
+        except Exception as e:
+            print(f"Error loading HPB IVF index: {e}")
+            return None
+
+    def candidates(self, query, nprobe):
+        """Matrix row positions in the `nprobe` lists closest to a normalized query."""
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.members[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+class HPBEmbeddingIndex:
+    """
+    Process-wide in-memory index over hpb_embeddings.
+
+    All vectors are held in a single pre-normalized float32 matrix so a query
+    is one matrix-vector product plus argpartition instead of a Python loop.
+    """
+
+    def __init__(self, db_path=DB_PATH, sidecar_path=SIDECAR_PATH, sidecar_meta_path=SIDECAR_META_PATH,
+                 backend=ANN_BACKEND, ivf_path=IVF_PATH, nprobe=IVF_NPROBE):
+        self.db_path = db_path
+        self.sidecar_path = sidecar_path
+        self.sidecar_meta_path = sidecar_meta_path
+        self.backend = backend
+        self.ivf_path = ivf_path
+        self.nprobe = nprobe
+        # (matrix, rows, missing, ivf): rows are {name, crId, desc, unit, weight} dicts aligned
+        # with matrix rows, or None where the hpb_foods row no longer exists. ivf is None
+        # unless the "ivf" backend is enabled and its index matches the current rows.
+        self._snapshot = (np.zeros((0, 0), dtype=np.float32), [], np.zeros(0, dtype=bool), None)
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._static = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_matrix(cls, matrix, rows, backend="exact", ivf=None, nprobe=IVF_NPROBE):
+        """Fixed in-memory index that never touches the database (benchmarks, tests)."""
+        index = cls(backend=backend, nprobe=nprobe)
+        missing = np.array([r is None for r in rows], dtype=bool)
+        index._snapshot = (matrix, rows, missing, ivf if backend == "ivf" else None)
+        index._static = True
+        return index
+
+    def _load_sidecar(self, fingerprint):
+        """Memory-map the .npy sidecar if it matches the current table contents."""
+        if not (os.path.exists(self.sidecar_path) and os.path.exists(self.sidecar_meta_path)):
+            return None
+        try:
+            with open(self.sidecar_meta_path, "r") as f:
+                meta = json.load(f)
+            if meta.get("fingerprint") != fingerprint or meta.get("model") != EMBEDDING_MODEL:
+                print("HPB embedding sidecar is stale, falling back to the database.")
+                return None
+            matrix = np.load(self.sidecar_path, mmap_mode="r")
+            if matrix.shape[0] != len(meta["crIds"]):
+                return None
+            return meta["crIds"], matrix
+        except Exception as e:
+            print(f"Error loading HPB embedding sidecar: {e}")
+            return None
+
+    def _load(self, conn, fingerprint):
+        loaded = self._load_sidecar(fingerprint)
+        crIds, matrix = loaded if loaded else _read_embeddings(conn)
+
+        foods = {}
+        for name, crId, desc, unit, weight in conn.execute(
+            "SELECT name, crId, description, default_unit, default_weight FROM hpb_foods"
+        ):
+            foods[crId] = {
+                "name": name,
+                "crId": crId,
+                "desc": desc,
+                "unit": unit or "unit",
+                "weight": weight or 0
+            }
+        rows = [foods.get(crId) for crId in crIds]
+        return matrix, rows
+
+    def ensure_fresh(self, force=False):
+        """Load the index on first use and reload it when the embeddings table changes."""
+        if self._static:
+            return
+        now = time.monotonic()
+        if not force and self._fingerprint is not None and now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return
+
+        with self._lock:
+            if not force and self._fingerprint is not None and now - self._last_check < RELOAD_CHECK_INTERVAL:
+                return
+            conn = sqlite3.connect(self.db_path)
+            try:
+                fingerprint = _read_fingerprint(conn)
+                if force or fingerprint != self._fingerprint:
+                    started = time.perf_counter()
+                    matrix, rows = self._load(conn, fingerprint)
+                    missing = np.array([r is None for r in rows], dtype=bool)
+                    ivf = None
+                    if self.backend == "ivf" and rows:
+                        ivf = IVFIndex.load(self.ivf_path, fingerprint, len(rows))
+                    # Swap in one assignment so readers never see a half-built index
+                    self._snapshot = (matrix, rows, missing, ivf)
+                    self._fingerprint = fingerprint
+                    print(f"HPB index loaded: {len(rows)} vectors in {time.perf_counter() - started:.2f}s")
+                self._last_check = now
+            finally:
+                conn.close()
+
+    def search(self, query_vec, limit=10):
+        """Return the top `limit` catalogue rows by cosine similarity to query_vec."""
+        return self.search_many([query_vec], limit=limit)[0]
+
+    def search_many(self, query_vecs, limit=10):
+        """
+        Score several queries in one matrix-matrix product.
+        Returns one ranked candidate list per query, in input order.
+        """
+        self.ensure_fresh()
+        matrix, rows, missing, ivf = self._snapshot
+        if not len(query_vecs):
+            return []
+        if not rows or limit <= 0:
+            return [[] for _ in query_vecs]
+
+        queries = np.asarray(query_vecs, dtype=np.float32).reshape(len(query_vecs), -1)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        zero = norms[:, 0] == 0
+        norms[zero] = 1.0
+        queries = queries / norms
+
+        if ivf is not None:
+            return [[] if zero[q] else self._search_ivf(ivf, matrix, rows, missing, queries[q], limit)
+                    for q in range(len(queries))]
+
+        scores = queries @ matrix.T
+        if missing.any():
+            # Embeddings whose hpb_foods row has gone away can never be returned
+            scores[:, missing] = -np.inf
+
+        k = min(limit, len(rows))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for q, candidates in enumerate(top):
+            if zero[q]:
+                results.append([])
+                continue
+            q_scores = scores[q]
+            candidates = candidates[np.argsort(-q_scores[candidates])]
+            results.append([dict(rows[i], score=float(q_scores[i])) for i in candidates if rows[i] is not None])
+        return results
+
+    def _search_ivf(self, ivf, matrix, rows, missing, query, limit):
+        positions = ivf.candidates(query, self.nprobe)
+        positions = positions[~missing[positions]]
+        if not len(positions):
+            return []
+        scores = matrix[positions] @ query
+        k = min(limit, len(positions))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(rows[positions[i]], score=float(scores[i])) for i in top]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """Return the process-wide HPB embedding index, creating it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = HPBEmbeddingIndex()
+    return _index
@@ -0,0 +1,130 @@
+import sqlite3
+import re
+import threading
+
+# Configuration
+DB_PATH = "calorie_tracker.db"
+# Reciprocal rank fusion constant (standard value from the RRF paper)
+RRF_K = 60
+
+_lock = threading.Lock()
+_fts_ready = False
+
+def _normalize(text):
+    return " ".join(re.findall(r"[a-z0-9]+", str(text or "").lower()))
+
+def create_fts(conn):
+    """Create the FTS5 mirror of hpb_foods (name / description / categories)."""
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS hpb_foods_fts USING fts5(
+            id UNINDEXED,
+            crId UNINDEXED,
+            name,
+            description,
+            categories
+        )
+    """)
+
+def sync_items(conn, items):
+    """Mirror crawler rows (HPB API field names) into the FTS table. Caller commits."""
+    for item in items:
+        conn.execute("DELETE FROM hpb_foods_fts WHERE id = ?", (item.get('id'),))
+        conn.execute("""
+            INSERT INTO hpb_foods_fts (id, crId, name, description, categories)
+            VALUES (?, ?, ?, ?, ?)
+        """, (
+            item.get('id'),
+            item.get('crId'),
+            item.get('name'),
+            item.get('description'),
+            " ".join(x for x in (item.get('l1Category'), item.get('l2Category')) if x)
+        ))
+
+def _ensure_fts(conn):
+    """Create and backfill the FTS table once for databases crawled before it existed."""
+    global _fts_ready
+    if _fts_ready:
+        return
+    with _lock:
+        if _fts_ready:
+            return
+        create_fts(conn)
+        fts_count = conn.execute("SELECT COUNT(*) FROM hpb_foods_fts").fetchone()[0]
+        foods_count = conn.execute("SELECT COUNT(*) FROM hpb_foods").fetchone()[0]
+        if fts_count != foods_count:
+            print(f"Rebuilding hpb_foods_fts ({fts_count} -> {foods_count} rows)...")
+            conn.execute("DELETE FROM hpb_foods_fts")
+            conn.execute("""
+                INSERT INTO hpb_foods_fts (id, crId, name, description, categories)
+                SELECT id, crId, name, description,
+                       TRIM(COALESCE(category_l1, '') || ' ' || COALESCE(category_l2, ''))
+                FROM hpb_foods
+            """)
+            conn.commit()
+        _fts_ready = True
+
+def _match_expression(query):
+    # Quote every token so user text can never be parsed as FTS5 syntax
+    tokens = _normalize(query).split()
+    return " OR ".join(f'"{t}"' for t in tokens)
+
+def search_many(queries, limit=10):
+    """
+    BM25-ranked hpb_foods rows for each query, best first. Each result has the
+    same fields as a semantic candidate plus its "bm25" score.
+    """
+    results = [[] for _ in queries]
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            _ensure_fts(conn)
+            for i, query in enumerate(queries):
+                expression = _match_expression(query)
+                if not expression:
+                    continue
+                rows = conn.execute("""
+                    SELECT f.crId, h.name, h.description, h.default_unit, h.default_weight,
+                           bm25(hpb_foods_fts, 0, 0, 10.0, 2.0, 1.0) AS rank
+                    FROM hpb_foods_fts f
+                    JOIN hpb_foods h ON h.id = f.id
+                    WHERE hpb_foods_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ?
+                """, (expression, limit * 2)).fetchall()
+                seen = set()
+                for crId, name, desc, unit, weight, rank in rows:
+                    if crId in seen:
+                        continue
+                    seen.add(crId)
+                    results[i].append({
+                        "name": name,
+                        "crId": crId,
+                        "desc": desc,
+                        "unit": unit or "unit",
+                        "weight": weight or 0,
+                        "bm25": -rank
+                    })
+                    if len(results[i]) >= limit:
+                        break
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Lexical search error: {e}")
+    return results
+
+def is_confident(query, lexical_hits):
+    """High-confidence lexical match: the top hit's name is literally the query."""
+    return bool(lexical_hits) and _normalize(lexical_hits[0]["name"]) == _normalize(query)
+
+def rrf_fuse(ranked_lists, limit=10):
+    """Reciprocal rank fusion of several best-first candidate lists, keyed by crId."""
+    fused = {}
+    for ranked in ranked_lists:
+        for rank, cand in enumerate(ranked):
+            entry = fused.setdefault(cand["crId"], dict(cand, score=0.0))
+            entry["score"] += 1.0 / (RRF_K + rank + 1)
+            if "score" in cand:
+                entry["vector_score"] = cand["score"]
+            if "bm25" in cand:
+                entry["bm25"] = cand["bm25"]
+    return sorted(fused.values(), key=lambda x: x["score"], reverse=True)[:limit]
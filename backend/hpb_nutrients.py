@@ -0,0 +1,243 @@
+import requests
+import sqlite3
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+import metrics
+
+# Configuration
+DB_PATH = "calorie_tracker.db"
+# Nutrient values essentially never change; refresh them after this many days
+TTL_SECONDS = float(os.getenv("HPB_NUTRIENT_TTL_DAYS", "30")) * 86400
+
+# Overridable so the fetch path can be exercised against a local stub server
+HPB_API_BASE = os.getenv("HPB_API_BASE", "https://pphtpc.hpb.gov.sg")
+HPB_DETAILS_URL = HPB_API_BASE.rstrip("/") + "/bff/v1/food-portal/foods/details/{crId}"
+# Network fetch pool: total workers, max in-flight requests per host and
+# the overall budget for one meal's lookups
+FETCH_WORKERS = int(os.getenv("HPB_FETCH_WORKERS", "8"))
+MAX_PER_HOST = int(os.getenv("HPB_MAX_PER_HOST", "4"))
+FETCH_DEADLINE = float(os.getenv("HPB_FETCH_DEADLINE", "12"))
+# After a failed fetch, skip the portal for this crId for this long
+NEGATIVE_TTL_SECONDS = float(os.getenv("HPB_NEGATIVE_TTL_SECONDS", "60"))
+REQUEST_TIMEOUT = 10
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "application/json"
+}
+
+# crId -> (details dict, fetched_at)
+_cache = {}
+_lock = threading.Lock()
+_table_ready = False
+
+# One keep-alive session shared by all fetch threads
+_session = requests.Session()
+_session.headers.update(HEADERS)
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=max(FETCH_WORKERS, MAX_PER_HOST)))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=max(FETCH_WORKERS, MAX_PER_HOST)))
+_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="hpb-fetch")
+_host_slots = {}
+# crId -> Future of the fetch in flight (one per crId); crId -> monotonic time a failure stops counting
+_inflight = {}
+_failed_until = {}
+
+def parse_portion_unit(portion_str):
+    """Parses strings like '1 plate(s) = 418g' to extract the unit."""
+    if not portion_str or portion_str == "-":
+        return "unit"
+    clean = portion_str.replace("(s)", "").strip()
+    match = re.search(r'\d+\s+(.*?)\s*=', clean)
+    if match:
+        return match.group(1).strip()
+    parts = clean.split()
+    if parts and not parts[0].isdigit():
+        return parts[0]
+    if len(parts) > 1:
+        return parts[1]
+    return "unit"
+
+def parse_details(data):
+    """Turn an HPB details payload into our {calories, protein, carbs, fat, unit} dict."""
+    nutrients = data.get("calculatedFoodNutrients", {})
+    raw_portion = data.get("defaultPortion", "")
+    return {
+        "calories": round(nutrients.get("energy", 0)),
+        "protein": round(nutrients.get("protein", 0)),
+        "carbs": round(nutrients.get("carbohydrate", 0)),
+        "fat": round(nutrients.get("fat", 0)),
+        "unit": parse_portion_unit(raw_portion)
+    }
+
+def _host_slot(url):
+    host = urlparse(url).netloc
+    with _lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return _host_slots[host]
+
+def fetch_remote(crId, timeout=REQUEST_TIMEOUT):
+    """Fetch nutrition data for a specific crId from the HPB portal."""
+    url = HPB_DETAILS_URL.format(crId=crId)
+    slot = _host_slot(url)
+    if not slot.acquire(timeout=timeout):
+        print(f"Timed out waiting for an HPB connection slot for {crId}")
+        return None
+    try:
+        response = _session.get(url, timeout=timeout)
+        if response.status_code == 200:
+            return parse_details(response.json())
+    except Exception as e:
+        print(f"Error fetching HPB details for {crId}: {e}")
+    finally:
+        slot.release()
+    return None
+
+def _connect():
+    global _table_ready
+    conn = sqlite3.connect(DB_PATH)
+    if not _table_ready:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS hpb_nutrients (
+                crId TEXT PRIMARY KEY,
+                calories INTEGER,
+                protein INTEGER,
+                carbs INTEGER,
+                fat INTEGER,
+                unit TEXT,
+                fetched_at REAL
+            )
+        """)
+        conn.commit()
+        _table_ready = True
+    return conn
+
+def _load_row(crId):
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                "SELECT calories, protein, carbs, fat, unit, fetched_at FROM hpb_nutrients WHERE crId = ?",
+                (crId,)
+            ).fetchone()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"HPB nutrient store read error: {e}")
+        return None
+    if not row:
+        return None
+    cal, p, c, f, unit, fetched_at = row
+    return {"calories": cal, "protein": p, "carbs": c, "fat": f, "unit": unit or "unit"}, fetched_at or 0
+
+def store(crId, details, fetched_at=None):
+    """Write-through: persist details for crId and keep them in the process cache."""
+    fetched_at = fetched_at or time.time()
+    with _lock:
+        _cache[crId] = (details, fetched_at)
+    try:
+        conn = _connect()
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO hpb_nutrients (crId, calories, protein, carbs, fat, unit, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (crId, details["calories"], details["protein"], details["carbs"], details["fat"],
+                  details.get("unit", "unit"), fetched_at))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"HPB nutrient store write error: {e}")
+
+def _lookup_local(crId):
+    """Return the (details, fetched_at) entry from the process cache or the table."""
+    with _lock:
+        entry = _cache.get(crId)
+    if entry is None:
+        entry = _load_row(crId)
+        if entry:
+            with _lock:
+                _cache[crId] = entry
+    return entry
+
+def _fetch_and_store(crId, deadline_at):
+    try:
+        details = fetch_remote(crId, timeout=max(0.1, min(REQUEST_TIMEOUT, deadline_at - time.monotonic())))
+        if details:
+            store(crId, details)
+        with _lock:
+            if details:
+                _failed_until.pop(crId, None)
+            else:
+                _failed_until[crId] = time.monotonic() + NEGATIVE_TTL_SECONDS
+        return details
+    finally:
+        with _lock:
+            _inflight.pop(crId, None)
+
+def _fetch_async(crId, deadline_at):
+    """
+    The in-flight fetch for crId, starting one unless the portal failed for it
+    within NEGATIVE_TTL_SECONDS (then None).
+    """
+    with _lock:
+        future = _inflight.get(crId)
+        if future is not None:
+            return future
+        if _failed_until.get(crId, 0) > time.monotonic():
+            return None
+        future = _inflight[crId] = _executor.submit(_fetch_and_store, crId, deadline_at)
+        return future
+
+def get_details_many(crIds, deadline=FETCH_DEADLINE):
+    """
+    Nutrition data for several crIds. Local hits are served immediately, and
+    so are expired ones (stale-while-revalidate: they are refreshed in the
+    background, one fetch per crId). Only crIds with no local entry wait on
+    the portal, concurrently on the shared pool, for at most `deadline`
+    seconds. Recent failures are not retried for NEGATIVE_TTL_SECONDS.
+    """
+    results = {}
+    pending = {}
+    deadline_at = time.monotonic() + deadline
+
+    for crId in dict.fromkeys(crIds):
+        entry = _lookup_local(crId)
+        if entry:
+            results[crId] = entry[0]
+            if time.time() - entry[1] < TTL_SECONDS:
+                metrics.inc("fuel_hpb_nutrient_lookups_total", source="local")
+            else:
+                _fetch_async(crId, time.monotonic() + REQUEST_TIMEOUT)
+                metrics.inc("fuel_hpb_nutrient_lookups_total", source="stale")
+            continue
+        future = _fetch_async(crId, deadline_at)
+        if future is None:
+            results[crId] = None
+            metrics.inc("fuel_hpb_nutrient_lookups_total", source="missing")
+            continue
+        pending[crId] = future
+
+    if pending:
+        wait(list(pending.values()), timeout=max(0, deadline_at - time.monotonic()))
+
+    for crId, future in pending.items():
+        details = future.result() if future.done() else None
+        if details:
+            results[crId] = details
+            metrics.inc("fuel_hpb_nutrient_lookups_total", source="remote")
+        else:
+            results[crId] = None
+            metrics.inc("fuel_hpb_nutrient_lookups_total", source="missing")
+    return results
+
+def get_details(crId):
+    """
+    Nutrition data for crId: process cache, then the hpb_nutrients table,
+    then the HPB portal. An expired entry is served while it refreshes.
+    """
+    return get_details_many([crId]).get(crId)
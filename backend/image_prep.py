@@ -0,0 +1,60 @@
+import io
+import os
+import mimetypes
+import PIL.Image
+import PIL.ImageOps
+
+# Longest edge sent to the model; phone photos are far larger than it needs
+MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+def normalize_image(path, max_edge=MAX_EDGE):
+    """
+    Decode an upload once, in memory: first frame of animated formats, EXIF
+    orientation applied, RGB, downscaled to max_edge. Returns JPEG bytes.
+    """
+    with PIL.Image.open(path) as img:
+        if getattr(img, "n_frames", 1) > 1:
+            img.seek(0)
+        img = PIL.ImageOps.exif_transpose(img)
+        img = img.convert("RGB")
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), PIL.Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=JPEG_QUALITY)
+        return buffer.getvalue()
+
+def prepare_images(image_paths, max_edge=MAX_EDGE):
+    """
+    Normalize every upload for the model. Returns inline blob parts
+    ({"mime_type", "data"}) that can be reused across all passes and retries.
+    """
+    parts = []
+    for path in image_paths or []:
+        try:
+            parts.append({"mime_type": "image/jpeg", "data": normalize_image(path, max_edge)})
+        except Exception as e:
+            print(f"Error standardizing image {path}: {e}")
+            # Fall back to the original bytes and let the model try
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                parts.append({"mime_type": mimetypes.guess_type(path)[0] or "image/jpeg", "data": data})
+            except OSError:
+                pass
+    return parts
+
+def shrink_parts(parts, max_edge):
+    """Smaller copies of already prepared parts, for cheap auxiliary model calls."""
+    shrunk = []
+    for part in parts:
+        try:
+            with PIL.Image.open(io.BytesIO(part["data"])) as img:
+                img = img.convert("RGB")
+                img.thumbnail((max_edge, max_edge), PIL.Image.LANCZOS)
+                buffer = io.BytesIO()
+                img.save(buffer, "JPEG", quality=JPEG_QUALITY)
+            shrunk.append({"mime_type": "image/jpeg", "data": buffer.getvalue()})
+        except Exception:
+            shrunk.append(part)
+    return shrunk
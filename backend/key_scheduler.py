@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import threading
+import time
+from collections import deque
+from google.api_core import exceptions as api_exceptions
+import metrics
+
+# Model Rotation Pool, best first
+MODELS = [
+    'gemini-2.0-flash-lite',
+    'gemini-flash-latest',
+    'gemini-pro-latest'
+]
+
+# Requests per minute we allow ourselves per (key, model); override with e.g. GEMINI_RPM_GEMINI_FLASH_LATEST=20
+DEFAULT_RPM = {
+    'gemini-2.0-flash-lite': 30,
+    'gemini-flash-latest': 15,
+    'gemini-pro-latest': 5,
+    # Retrieval query embeddings (ai_engine.embed_queries) share the scheduler too
+    'models/text-embedding-004': 150,
+}
+# First 429 benches a pair for this long; repeats within RECENT_WINDOW double it, up to MAX_COOLDOWN
+COOLDOWN_SECONDS = float(os.getenv("GEMINI_COOLDOWN_SECONDS", "30"))
+MAX_COOLDOWN_SECONDS = float(os.getenv("GEMINI_MAX_COOLDOWN_SECONDS", "600"))
+RECENT_WINDOW = 300
+# Consecutive transient failures (5xx, timeouts) before a pair's breaker opens
+FAILURE_THRESHOLD = int(os.getenv("GEMINI_FAILURE_THRESHOLD", "3"))
+
+class QuotaExhausted(Exception):
+    """Every key/model pair is throttled. main.py answers it with a 429; str() is AI_QUOTA_REACHED."""
+    def __init__(self, retry_after=None):
+        super().__init__("AI_QUOTA_REACHED")
+        self.retry_after = retry_after
+
+def _rpm_for(model):
+    env_name = "GEMINI_RPM_" + "".join(c if c.isalnum() else "_" for c in model).upper()
+    return float(os.getenv(env_name, DEFAULT_RPM.get(model, 10)))
+
+class _PairState:
+    """Token bucket plus throttling history for one (key, model) pair."""
+    __slots__ = ("capacity", "rate", "tokens", "updated", "cooldown_until", "recent_429s", "last_used",
+                 "failures", "tripped", "probing", "reason")
+
+    def __init__(self, rpm, now):
+        self.capacity = max(rpm, 1.0)
+        self.rate = rpm / 60.0
+        self.tokens = self.capacity
+        self.updated = now
+        self.cooldown_until = 0.0
+        self.recent_429s = deque()
+        self.last_used = 0.0
+        # Circuit breaker: tripped pairs sit out cooldown_until, then admit a single probe (half-open)
+        self.failures = 0
+        self.tripped = False
+        self.probing = False
+        self.reason = None
+
+    def trip(self, now, cooldown, reason):
+        self.tripped = True
+        self.reason = reason
+        self.probing = False
+        self.cooldown_until = max(self.cooldown_until, now + min(cooldown, MAX_COOLDOWN_SECONDS))
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        while self.recent_429s and now - self.recent_429s[0] > RECENT_WINDOW:
+            self.recent_429s.popleft()
+
+_lock = threading.Lock()
+_pairs = {}
+
+def _state(key_idx, model, now):
+    state = _pairs.get((key_idx, model))
+    if state is None:
+        state = _pairs[(key_idx, model)] = _PairState(_rpm_for(model), now)
+    state.refill(now)
+    return state
+
+def plan(key_indices, models=MODELS):
+    """
+    Yield (key_idx, model) pairs to attempt, healthiest first.
+
+    Pairs whose breaker is open are never handed out; once the cooldown has
+    passed, one caller at a time gets the pair as a probe. Among the rest,
+    pairs with budget left beat over-budget ones, then model preference, then
+    the pair with fewer recent 429s, more tokens and the oldest last use (so
+    equal keys alternate). A token is taken as each pair is yielded, and the
+    ranking is redone per attempt so concurrent callers see each other's usage.
+    """
+    tried = set()
+    while True:
+        with _lock:
+            now = time.monotonic()
+            best, best_rank = None, None
+            for rank_idx, model in enumerate(models):
+                for key_idx in key_indices:
+                    if (key_idx, model) in tried:
+                        continue
+                    state = _state(key_idx, model, now)
+                    if state.cooldown_until > now or (state.tripped and state.probing):
+                        continue
+                    rank = (state.tokens < 1, rank_idx, len(state.recent_429s), -state.tokens, state.last_used)
+                    if best_rank is None or rank < best_rank:
+                        best, best_rank = (key_idx, model), rank
+            if best is None:
+                return
+            state = _pairs[best]
+            if state.tripped:
+                state.probing = True
+            # Over-budget pairs go into debt so load stays spread while everything is exhausted
+            state.tokens = max(state.tokens - 1, -state.capacity)
+            state.last_used = now
+        tried.add(best)
+        yield best
+
+def record_success(key_idx, model):
+    metrics.inc("fuel_gemini_calls_total", key=key_idx, model=model, outcome="ok")
+    with _lock:
+        state = _state(key_idx, model, time.monotonic())
+        state.recent_429s.clear()
+        state.failures = 0
+        state.tripped = False
+        state.probing = False
+        state.reason = None
+
+def classify_error(exc):
+    """
+    rate_limit: 429 / quota, wait it out on this pair and move on.
+    transient:  5xx, timeouts, dropped connections; counts towards the breaker.
+    auth:       bad or revoked key; bench the key for every model.
+    unavailable: model not served for this key; bench the pair.
+    fatal:      the request itself is invalid (400); no other pair will accept it.
+    bad_output: the model answered but we could not parse it; just try the next pair.
+    """
+    text = str(exc)
+    if isinstance(exc, (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests)) or "429" in text:
+        return "rate_limit"
+    if isinstance(exc, (api_exceptions.Unauthenticated, api_exceptions.PermissionDenied)) or "API key not valid" in text:
+        return "auth"
+    if isinstance(exc, api_exceptions.NotFound):
+        return "unavailable"
+    if isinstance(exc, (api_exceptions.InvalidArgument, api_exceptions.BadRequest)):
+        return "fatal"
+    if isinstance(exc, (api_exceptions.ServerError, api_exceptions.DeadlineExceeded, api_exceptions.RetryError,
+                        TimeoutError, ConnectionError)):
+        return "transient"
+    if isinstance(exc, (json.JSONDecodeError, KeyError, TypeError, ValueError)):
+        return "bad_output"
+    return "transient"
+
+def retry_delay(exc):
+    """Server-provided retry delay in seconds (RetryInfo / "retry in Ns"), if any."""
+    for detail in getattr(exc, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and getattr(delay, "seconds", None) is not None:
+            return float(delay.seconds) + getattr(delay, "nanos", 0) / 1e9
+    text = str(exc)
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", text) or re.search(r"retry in ([\d.]+)\s*s", text, re.I)
+    if match:
+        return float(match.group(1))
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def record_error(key_idx, model, exc):
+    """Feed a failed call back into the breaker and return its classification."""
+    kind = classify_error(exc)
+    metrics.inc("fuel_gemini_calls_total", key=key_idx, model=model, outcome=kind)
+    if kind == "rate_limit":
+        metrics.inc("fuel_gemini_rate_limited_total", key=key_idx, model=model)
+    with _lock:
+        now = time.monotonic()
+        state = _state(key_idx, model, now)
+        if kind == "rate_limit":
+            # Back-to-back 429s lengthen the cooldown; a server-provided delay is a floor
+            state.recent_429s.append(now)
+            cooldown = COOLDOWN_SECONDS * 2 ** (len(state.recent_429s) - 1)
+            state.trip(now, max(cooldown, retry_delay(exc) or 0), kind)
+            state.tokens = 0.0
+        elif kind == "auth":
+            for other_model in {m for (k, m) in _pairs if k == key_idx} | {model}:
+                _state(key_idx, other_model, now).trip(now, MAX_COOLDOWN_SECONDS, kind)
+        elif kind == "unavailable":
+            state.trip(now, MAX_COOLDOWN_SECONDS, kind)
+        elif kind == "transient":
+            state.failures += 1
+            if state.probing or state.failures >= FAILURE_THRESHOLD:
+                state.trip(now, COOLDOWN_SECONDS * 2 ** max(0, state.failures - FAILURE_THRESHOLD), kind)
+        else:
+            state.probing = False
+        remaining = max(0.0, state.cooldown_until - now)
+    if remaining:
+        print(f"Key {key_idx} + Model {model} {kind}, breaker open for {remaining:.0f}s")
+    return kind
+
+def seconds_until_available(key_indices, models=MODELS):
+    """How long until the first pair's breaker lets a call through again."""
+    with _lock:
+        now = time.monotonic()
+        waits = [max(0.0, _state(k, m, now).cooldown_until - now) for k in key_indices for m in models]
+    return min(waits) if waits else None
+
+def is_throttled(key_indices, models=MODELS):
+    """True if any of these pairs is sitting out a 429 right now."""
+    with _lock:
+        now = time.monotonic()
+        return any(
+            state.reason == "rate_limit" and state.cooldown_until > now
+            for (k, m), state in _pairs.items() if k in key_indices and m in models
+        )
+
+def snapshot():
+    """Per-pair view of the scheduler, for logging and metrics."""
+    with _lock:
+        now = time.monotonic()
+        for state in _pairs.values():
+            state.refill(now)
+        return [
+            {
+                "key": key_idx,
+                "model": model,
+                "tokens": round(state.tokens, 2),
+                "recent_429s": len(state.recent_429s),
+                "failures": state.failures,
+                "open": state.tripped and state.cooldown_until > now,
+                "reason": state.reason,
+                "cooldown_remaining": max(0.0, round(state.cooldown_until - now, 1)),
+            }
+            for (key_idx, model), state in sorted(_pairs.items())
+        ]
+
+def _collect():
+    pairs = snapshot()
+    return [
+        ("fuel_gemini_tokens", "gauge", "Token bucket level per key/model",
+         [({"key": p["key"], "model": p["model"]}, p["tokens"]) for p in pairs]),
+        ("fuel_gemini_breaker_open", "gauge", "1 while a key/model circuit breaker is open",
+         [({"key": p["key"], "model": p["model"]}, int(p["open"])) for p in pairs]),
+    ]
+
+metrics.register_collector(_collect)
@@ -1,14 +1,21 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, status, Form
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, status, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
 from typing import Optional, Union
 import database
 import ai_engine
+import analysis_queue
 import auth
+import key_scheduler
+import meal_stats
+import metrics
+import share_cache
+import thumbnails
 import os
 import shutil
 import json
@@ -16,7 +23,11 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
 import logging
+import time
 
 # Configure logging
 logging.basicConfig(
@@ -80,9 +91,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template (/meal/{meal_id}), never the raw path, to keep series bounded
+        route = request.scope.get("route")
+        metrics.observe(
+            "fuel_http_request_seconds", time.perf_counter() - started,
+            method=request.method, route=getattr(route, "path", "unmatched"), status=status_code
+        )
+
 # Initialize DB
 database.init_db()
 
+# The AI pipeline is fully blocking (Gemini calls, PIL, HPB requests), so it
+# runs on its own bounded pool instead of freezing the event loop.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+
+def quota_http_error(e):
+    """429 for a QuotaExhausted from the AI pipeline, with Retry-After when the breakers know when to reopen."""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="AI Quota limit reached. This is an external API limitation, not an app error. Please try again in a few minutes.",
+        headers={"Retry-After": str(int(e.retry_after) + 1)} if e.retry_after else None
+    )
+
+async def run_analysis(image_paths, description, use_cache=True):
+    """Run ai_engine.estimate_calories on the analysis pool and await the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        analysis_executor,
+        functools.partial(ai_engine.estimate_calories, image_paths, description, use_cache=use_cache)
+    )
+
+def accept_meal(db: Session, user: database.User, saved_paths, description, meal_type):
+    """Persist a meal as pending, queue its analysis and answer 202 right away."""
+    new_meal = database.Meal(
+        user_id=user.id,
+        food_name="Analyzing...",
+        meal_type=meal_type,
+        description=description,
+        calories=0,
+        protein=0,
+        carbs=0,
+        fat=0,
+        image_paths=json.dumps(saved_paths),
+        items_json=json.dumps([]),
+        timestamp=get_sg_time(),
+        status="pending"
+    )
+    db.add(new_meal)
+    meal_stats.refresh_day(db, user.id, new_meal.timestamp.date())
+    db.commit()
+    analysis_queue.enqueue(new_meal.id)
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+        "status": "pending",
+        "job_id": new_meal.id,
+        "meal_id": new_meal.id,
+        "status_url": f"/meal/{new_meal.id}/status"
+    })
+
+@app.on_event("startup")
+def resume_pending_analyses():
+    # Pick up meals accepted before a crash/restart that never got their macros
+    analysis_queue.resume_pending()
+
 # Models
 class UserCreate(BaseModel):
     email: str
@@ -208,75 +288,131 @@ def reset_share_token(db: Session = Depends(database.get_db), current_user: data
     db.commit()
     return {"token": current_user.share_token}
 
+def history_groups(db, user, day_groups, today_sg, public=False, summary_map=None, feedback_map=None):
+    """
+    Render meal_stats day groups as the grouped_history entries the dashboard shows.
+    The public (trainer) view adds trainer notes and falls back to the cached summary;
+    the owner's view carries each meal's analysis status instead.
+    """
+    dates = {totals["date"] for totals, _ in day_groups}
+    if feedback_map is None:
+        feedback_map = meal_stats.notes_for_days(db, database.DailyFeedback, user.id, dates)
+    if summary_map is None:
+        summary_map = meal_stats.notes_for_days(db, database.DailySummary, user.id, dates)
+
+    grouped_history = []
+    for totals, meals_list in day_groups:
+        date_str = totals["date"]
+        date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        ai_summary = summary_map.get(date_str)
+        if public:
+            ai_summary = ai_summary or (user.cached_summary if date_str == user.summary_date else None)
+        
+        meals = []
+        for m in meals_list:
+            meal = {
+                "id": m.id, 
+                "food": m.food_name, 
+                "meal_type": m.meal_type,
+                "description": m.description,
+                "calories": m.calories, 
+                "protein": m.protein,
+                "carbs": m.carbs,
+                "fat": m.fat,
+                "items": json.loads(m.items_json) if m.items_json else [],
+            }
+            if public:
+                meal["trainer_notes"] = m.trainer_notes
+            else:
+                meal["status"] = m.status or "done"
+            meal["time"] = m.timestamp.isoformat()
+            meal.update(thumbnails.image_urls(m.image_paths))
+            meals.append(meal)
+
+        grouped_history.append({
+            "date": date_str,
+            "display_date": "Today" if date == today_sg else date.strftime("%d %b, %Y"),
+            "trainer_feedback": feedback_map.get(date_str),
+            "ai_summary": ai_summary,
+            "totals": {
+                "calories": totals["calories"],
+                "protein": totals["protein"],
+                "carbs": totals["carbs"],
+                "fat": totals["fat"]
+            },
+            "meals": meals
+        })
+    return grouped_history
+
+def parse_before(before: Optional[str]):
+    """The ?before= history cursor (YYYY-MM-DD), None when absent."""
+    if not before:
+        return None
+    try:
+        return datetime.strptime(before, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="before must be a YYYY-MM-DD date")
+
 @app.get("/public/stats/{token}")
-def get_public_stats(token: str, db: Session = Depends(database.get_db)):
+def get_public_stats(token: str, request: Request, db: Session = Depends(database.get_db)):
     user = db.query(database.User).filter(database.User.share_token == token, database.User.share_enabled == 1).first()
     if not user:
         raise HTTPException(status_code=404, detail="Share link not found or disabled")
     
+    # The rendered payload is cached per token and stamped with the user's data_version,
+    # so trainers polling an unchanged page get a 304 (or the cached body) without a rebuild
+    today_sg = get_sg_time().date()
+    stamp = share_cache.make_stamp(user, today_sg.isoformat())
+    headers = {"ETag": share_cache.etag(stamp), "Cache-Control": "no-cache"}
+    if share_cache.matches(request.headers.get("if-none-match"), headers["ETag"]):
+        metrics.inc("fuel_share_cache_total", result="not_modified")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    body = share_cache.get(token, stamp)
+    if body is None:
+        metrics.inc("fuel_share_cache_total", result="miss")
+        body = JSONResponse(public_stats_payload(db, user, today_sg)).body
+        share_cache.put(token, stamp, body)
+    else:
+        metrics.inc("fuel_share_cache_total", result="hit")
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def public_stats_payload(db, user, today_sg):
     # Reuse the logic from get_stats but for the shared user
-    now_sg = get_sg_time()
-    today_sg = now_sg.date()
-    meals_today = [m for m in user.meals if m.timestamp.date() == today_sg]
+    today_str = today_sg.isoformat()
+    day_groups = meal_stats.recent_day_groups(db, user.id, today_sg)
+    today_totals = next(
+        (totals for totals, _ in day_groups if totals["date"] == today_str),
+        None
+    ) or meal_stats.totals_for_day(db, user.id, today_sg)
     
     # For public view, we don't regenerate summary to avoid quota drain, 
     # we just show the latest one if it exists
-    daily_summary = user.cached_summary if user.summary_date == today_sg.isoformat() else "No summary available."
+    daily_summary = user.cached_summary if user.summary_date == today_str else "No summary available."
 
-    # Group meals by day
-    from itertools import groupby
-    sorted_meals = sorted(user.meals, key=lambda x: x.timestamp, reverse=True)
-    grouped_history = []
-    
-    # Fetch all daily feedbacks and summaries for this user
-    all_feedbacks = db.query(database.DailyFeedback).filter(database.DailyFeedback.user_id == user.id).all()
-    feedback_map = {f.date: f.content for f in all_feedbacks}
-    
-    all_summaries = db.query(database.DailySummary).filter(database.DailySummary.user_id == user.id).all()
-    summary_map = {s.date: s.content for s in all_summaries}
-    
-    for date, items in groupby(sorted_meals, key=lambda x: x.timestamp.date()):
-        date_str = date.isoformat()
-        meals_list = list(items)
-        grouped_history.append({
-            "date": date_str,
-            "display_date": "Today" if date == today_sg else date.strftime("%d %b, %Y"),
-            "trainer_feedback": feedback_map.get(date_str),
-            "ai_summary": summary_map.get(date_str) or (user.cached_summary if date_str == user.summary_date else None),
-            "totals": {
-                "calories": sum(m.calories for m in meals_list),
-                "protein": sum(m.protein for m in meals_list),
-                "carbs": sum(m.carbs for m in meals_list),
-                "fat": sum(m.fat for m in meals_list)
-            },
-            "meals": [
-                {
-                    "id": m.id, 
-                    "food": m.food_name, 
-                    "meal_type": m.meal_type,
-                    "description": m.description,
-                    "calories": m.calories, 
-                    "protein": m.protein,
-                    "carbs": m.carbs,
-                    "fat": m.fat,
-                    "items": json.loads(m.items_json) if m.items_json else [],
-                    "trainer_notes": m.trainer_notes,
-                    "time": m.timestamp.isoformat(),
-                    "images": [f"/uploads/{os.path.basename(p)}" for p in json.loads(m.image_paths)] if m.image_paths and m.image_paths.startswith('[') else []
-                }
-                for m in meals_list
-            ]
-        })
+    grouped_history = history_groups(db, user, day_groups, today_sg, public=True)
 
     return {
         "user_name": user.name,
         "target": user.daily_target,
-        "consumed": sum(m.calories for m in meals_today),
-        "protein": sum(m.protein for m in meals_today),
-        "carbs": sum(m.carbs for m in meals_today),
-        "fat": sum(m.fat for m in meals_today),
+        "consumed": today_totals["calories"],
+        "protein": today_totals["protein"],
+        "carbs": today_totals["carbs"],
+        "fat": today_totals["fat"],
         "daily_summary": daily_summary,
-        "grouped_history": grouped_history[:7]
+        "grouped_history": grouped_history
+    }
+
+@app.get("/public/history/{token}")
+def get_public_history(token: str, before: Optional[str] = None, days: int = meal_stats.HISTORY_DAYS, db: Session = Depends(database.get_db)):
+    user = db.query(database.User).filter(database.User.share_token == token, database.User.share_enabled == 1).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="Share link not found or disabled")
+    
+    day_groups, next_before = meal_stats.history_page(db, user.id, parse_before(before), days)
+    return {
+        "grouped_history": history_groups(db, user, day_groups, get_sg_time().date(), public=True),
+        "next_before": next_before
     }
 
 @app.post("/public/daily-feedback/{token}/{date}")
@@ -297,6 +433,7 @@ def update_daily_feedback(token: str, date: str, note: Optional[str] = Form(None
         else:
             feedback = database.DailyFeedback(user_id=user.id, date=date, content=note)
             db.add(feedback)
+    meal_stats.mark_changed(db, user.id, date)
     
     db.commit()
     return {"status": "success"}
@@ -313,6 +450,7 @@ async def upload_meal_internal(
     description: Optional[str] = Form(None),
     portion: float = Form(1.0),
     meal_type: Optional[str] = Form(None),
+    async_mode: bool = Form(False),
     db: Session = Depends(database.get_db)
 ):
     """Internal endpoint for Telegram Bot to upload meals."""
@@ -329,8 +467,12 @@ async def upload_meal_internal(
                 with open(file_path, "wb") as buffer:
                     shutil.copyfileobj(file.file, buffer)
                 saved_paths.append(file_path)
+            thumbnails.generate_in_background(saved_paths)
         
-        food_name, cals, p, c, f, items = ai_engine.estimate_calories(saved_paths if saved_paths else None, description)
+        if async_mode:
+            return accept_meal(db, user, saved_paths, description, meal_type)
+        
+        food_name, cals, p, c, f, items = await run_analysis(saved_paths if saved_paths else None, description)
         
         # We now trust the AI for portion sizing within its calculation
         calories = int(cals)
@@ -359,6 +501,7 @@ async def upload_meal_internal(
             database.DailySummary.user_id == user.id,
             database.DailySummary.date == today_str
         ).delete()
+        meal_stats.refresh_day(db, user.id, new_meal.timestamp.date())
         
         user.cached_summary = None
         db.commit()
@@ -371,14 +514,11 @@ async def upload_meal_internal(
             "carbs": carbs,
             "fat": fat,
             "items": items,
-            "total_today": sum(m.calories for m in user.meals if m.timestamp.date() == today_sg)
+            "total_today": meal_stats.totals_for_day(db, user.id, today_sg)["calories"]
         }
     except Exception as e:
-        if str(e) == "AI_QUOTA_REACHED":
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="AI Quota limit reached. This is an external API limitation, not an app error. Please try again in a few minutes."
-            )
+        if isinstance(e, key_scheduler.QuotaExhausted):
+            raise quota_http_error(e)
         logger.exception(f"Error during internal meal upload for {email}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -388,6 +528,7 @@ async def upload_meal(
     description: Optional[str] = Form(None),
     portion: float = Form(1.0),
     meal_type: Optional[str] = Form(None),
+    async_mode: bool = Form(False),
     db: Session = Depends(database.get_db),
     current_user: database.User = Depends(auth.get_current_user)
 ):
@@ -400,8 +541,12 @@ async def upload_meal(
                 with open(file_path, "wb") as buffer:
                     shutil.copyfileobj(file.file, buffer)
                 saved_paths.append(file_path)
+            thumbnails.generate_in_background(saved_paths)
         
-        food_name, cals, p, c, f, items = ai_engine.estimate_calories(saved_paths if saved_paths else None, description)
+        if async_mode:
+            return accept_meal(db, current_user, saved_paths, description, meal_type)
+        
+        food_name, cals, p, c, f, items = await run_analysis(saved_paths if saved_paths else None, description)
         
         calories = int(cals)
         protein = int(p)
@@ -429,6 +574,7 @@ async def upload_meal(
             database.DailySummary.user_id == current_user.id,
             database.DailySummary.date == today_str
         ).delete()
+        meal_stats.refresh_day(db, current_user.id, new_meal.timestamp.date())
         
         current_user.cached_summary = None 
         db.commit()
@@ -441,14 +587,11 @@ async def upload_meal(
             "carbs": carbs,
             "fat": fat,
             "items": items,
-            "total_today": sum(m.calories for m in current_user.meals if m.timestamp.date() == today_sg)
+            "total_today": meal_stats.totals_for_day(db, current_user.id, today_sg)["calories"]
         }
     except Exception as e:
-        if str(e) == "AI_QUOTA_REACHED":
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="AI Quota limit reached. This is an external API limitation, not an app error. Please try again in a few minutes."
-            )
+        if isinstance(e, key_scheduler.QuotaExhausted):
+            raise quota_http_error(e)
         logger.exception(f"Error during meal upload for {current_user.email}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -457,29 +600,22 @@ def get_stats(db: Session = Depends(database.get_db), current_user: database.Use
     now_sg = get_sg_time()
     today_sg = now_sg.date()
     today_str = today_sg.isoformat()
-    meals_today = [m for m in current_user.meals if m.timestamp.date() == today_sg]
+    # Read before anything else so /stats/changes?since=version never misses a change
+    version = current_user.data_version or 0
+    
+    # Only the last few days are loaded; per-day totals and the trend come from daily_rollups
+    day_groups = meal_stats.recent_day_groups(db, current_user.id, today_sg)
+    today_totals, meals_today = next(
+        ((totals, meals) for totals, meals in day_groups if totals["date"] == today_str),
+        (meal_stats.totals_for_day(db, current_user.id, today_sg), [])
+    )
     
     # Calculate 7-day trend
-    history_trend = []
-    for i in range(6, -1, -1):
-        day = today_sg - timedelta(days=i)
-        day_total = sum(m.calories for m in current_user.meals if m.timestamp.date() == day)
-        history_trend.append({
-            "day": day.strftime("%a"),
-            "amount": day_total
-        })
+    history_trend = meal_stats.trend(db, current_user.id, today_sg)
 
-    # Group meals by day
-    from itertools import groupby
-    sorted_meals = sorted(current_user.meals, key=lambda x: x.timestamp, reverse=True)
-    grouped_history = []
-    
-    # Fetch all daily feedbacks and summaries for this user to avoid multiple queries
-    all_feedbacks = db.query(database.DailyFeedback).filter(database.DailyFeedback.user_id == current_user.id).all()
-    feedback_map = {f.date: f.content for f in all_feedbacks}
-    
-    all_summaries = db.query(database.DailySummary).filter(database.DailySummary.user_id == current_user.id).all()
-    summary_map = {s.date: s.content for s in all_summaries}
+    dates = {totals["date"] for totals, _ in day_groups} | {today_str}
+    feedback_map = meal_stats.notes_for_days(db, database.DailyFeedback, current_user.id, dates)
+    summary_map = meal_stats.notes_for_days(db, database.DailySummary, current_user.id, dates)
     
     # 1. Get/Generate Today's AI Summary
     today_summary = summary_map.get(today_str)
@@ -492,55 +628,93 @@ def get_stats(db: Session = Depends(database.get_db), current_user: database.Use
         if generated:
             new_summary = database.DailySummary(user_id=current_user.id, date=today_str, content=generated)
             db.add(new_summary)
-            db.commit()
+            meal_stats.mark_changed(db, current_user.id, today_str)
+            try:
+                db.commit()
+            except IntegrityError:
+                # A concurrent poll stored today's summary first (unique per user and day)
+                db.rollback()
             today_summary = generated
         else:
             today_summary = "Generating your daily insights (AI is a bit busy)..."
 
-    for date, items in groupby(sorted_meals, key=lambda x: x.timestamp.date()):
-        date_str = date.isoformat()
-        meals_list = list(items)
-        
-        grouped_history.append({
-            "date": date_str,
-            "display_date": "Today" if date == today_sg else date.strftime("%d %b, %Y"),
-            "trainer_feedback": feedback_map.get(date_str),
-            "ai_summary": summary_map.get(date_str),
-            "totals": {
-                "calories": sum(m.calories for m in meals_list),
-                "protein": sum(m.protein for m in meals_list),
-                "carbs": sum(m.carbs for m in meals_list),
-                "fat": sum(m.fat for m in meals_list)
-            },
-            "meals": [
-                {
-                    "id": m.id, 
-                    "food": m.food_name, 
-                    "meal_type": m.meal_type,
-                    "description": m.description,
-                    "calories": m.calories, 
-                    "protein": m.protein,
-                    "carbs": m.carbs,
-                    "fat": m.fat,
-                    "items": json.loads(m.items_json) if m.items_json else [],
-                    "time": m.timestamp.isoformat(),
-                    "images": [f"/uploads/{os.path.basename(p)}" for p in json.loads(m.image_paths)] if m.image_paths and m.image_paths.startswith('[') else []
-                }
-                for m in meals_list
-            ]
-        })
+    grouped_history = history_groups(db, current_user, day_groups, today_sg, summary_map=summary_map, feedback_map=feedback_map)
 
     return {
         "target": current_user.daily_target,
-        "consumed": sum(m.calories for m in meals_today),
-        "protein": sum(m.protein for m in meals_today),
-        "carbs": sum(m.carbs for m in meals_today),
-        "fat": sum(m.fat for m in meals_today),
+        "consumed": today_totals["calories"],
+        "protein": today_totals["protein"],
+        "carbs": today_totals["carbs"],
+        "fat": today_totals["fat"],
         "daily_summary": today_summary,
-        "grouped_history": grouped_history[:7], # Last 7 days
-        "trend": history_trend
+        "grouped_history": grouped_history, # Last 7 days
+        "trend": history_trend,
+        "version": version
     }
 
+@app.get("/stats/changes")
+def get_stats_changes(since: int, db: Session = Depends(database.get_db), current_user: database.User = Depends(auth.get_current_user)):
+    """
+    Cheap dashboard polling: 204 when nothing changed since `since` (the
+    version from /stats or the previous poll). Otherwise it returns the
+    changed days in the grouped_history shape, plus the dates that no longer
+    have meals and the server's "today". "full": true means the caller should
+    reload /stats.
+    """
+    version, dates = meal_stats.changes(db, current_user.id, since)
+    if dates is not None and not dates:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    today_sg = get_sg_time().date()
+    if dates is None:
+        return {"version": version, "today": today_sg.isoformat(), "full": True, "days": [], "removed": []}
+    
+    day_groups = meal_stats.day_groups_for(db, current_user.id, dates)
+    shown = {totals["date"] for totals, _ in day_groups}
+    return {
+        "version": version,
+        "today": today_sg.isoformat(),
+        "full": False,
+        "days": history_groups(db, current_user, day_groups, today_sg),
+        "removed": sorted(dates - shown, reverse=True)
+    }
+
+@app.get("/history")
+def get_history(before: Optional[str] = None, days: int = meal_stats.HISTORY_DAYS, db: Session = Depends(database.get_db), current_user: database.User = Depends(auth.get_current_user)):
+    """Older days page by page: pass the oldest date you have as ?before=, then next_before."""
+    day_groups, next_before = meal_stats.history_page(db, current_user.id, parse_before(before), days)
+    return {
+        "grouped_history": history_groups(db, current_user, day_groups, get_sg_time().date()),
+        "next_before": next_before
+    }
+
+@app.get("/meal/{meal_id}/status")
+def get_meal_status(
+    meal_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: database.User = Depends(auth.get_current_user)
+):
+    meal = db.query(database.Meal).filter(
+        database.Meal.id == meal_id,
+        database.Meal.user_id == current_user.id
+    ).first()
+    if not meal:
+        raise HTTPException(status_code=404, detail="Meal not found")
+    
+    meal_status = meal.status or "done"
+    response = {"meal_id": meal.id, "status": meal_status}
+    if meal_status == "done":
+        response["analysis"] = {
+            "food": meal.food_name,
+            "calories": meal.calories,
+            "protein": meal.protein,
+            "carbs": meal.carbs,
+            "fat": meal.fat,
+            "items": json.loads(meal.items_json) if meal.items_json else []
+        }
+    elif meal_status == "failed":
+        response["error"] = meal.analysis_error
+    return response
+
 @app.post("/meal/{meal_id}/rerun")
 async def rerun_meal_analysis(
     meal_id: int, 
@@ -556,7 +730,8 @@ async def rerun_meal_analysis(
         
     try:
         image_paths = json.loads(meal.image_paths) if meal.image_paths else None
-        food_name, cals, p, c, f, items = ai_engine.estimate_calories(image_paths, meal.description or "")
+        # Forced rerun: bypass the result cache (the fresh result replaces the cached one)
+        food_name, cals, p, c, f, items = await run_analysis(image_paths, meal.description or "", use_cache=False)
         
         meal.food_name = food_name
         meal.calories = int(cals)
@@ -564,6 +739,7 @@ async def rerun_meal_analysis(
         meal.carbs = int(c)
         meal.fat = int(f)
         meal.items_json = json.dumps(items)
+        meal_stats.refresh_day(db, meal.user_id, meal.timestamp.date())
         
         db.commit()
         return {
@@ -579,6 +755,8 @@ async def rerun_meal_analysis(
         }
     except Exception as e:
         db.rollback()
+        if isinstance(e, key_scheduler.QuotaExhausted):
+            raise quota_http_error(e)
         raise HTTPException(status_code=500, detail=f"Rerun failed: {str(e)}")
 
 @app.post("/meal/{meal_id}/update-items")
@@ -612,6 +790,7 @@ async def update_meal_items(
         meal.protein = total_p
         meal.carbs = total_c
         meal.fat = total_f
+        meal_stats.refresh_day(db, current_user.id, meal.timestamp.date())
         
         db.commit()
         return {"status": "success", "calories": total_cal, "protein": total_p, "carbs": total_c, "fat": total_f}
@@ -640,6 +819,7 @@ def delete_meal(
         meal_date = meal.timestamp.date().isoformat()
         
         db.delete(meal)
+        meal_stats.refresh_day(db, current_user.id, meal.timestamp.date())
         
         # Clear the new persistent summary for that specific date
         db.query(database.DailySummary).filter(
@@ -665,6 +845,7 @@ def update_settings(
 ):
     if daily_target is not None:
         current_user.daily_target = daily_target
+        meal_stats.mark_changed(db, current_user.id)
     if password is not None:
         current_user.hashed_password = auth.get_password_hash(password)
     db.commit()
@@ -719,7 +900,7 @@ def get_admin_stats(db: Session = Depends(database.get_db), current_user: databa
         "fat": m.fat,
         "time": m.timestamp.isoformat(),
         "items": json.loads(m.items_json) if m.items_json else [],
-        "images": [f"/uploads/{os.path.basename(p)}" for p in json.loads(m.image_paths)] if m.image_paths and m.image_paths.startswith('[') else [],
+        **thumbnails.image_urls(m.image_paths),
         "has_image": bool(m.image_paths and m.image_paths != "[]")
     } for m in recent_meals]
 
@@ -731,6 +912,22 @@ def get_admin_stats(db: Session = Depends(database.get_db), current_user: databa
         "recent_logs": meal_logs
     }
 
+@app.get("/media/{size}/{filename}")
+def serve_derivative(size: str, filename: str):
+    """Thumbnail / medium derivative of an upload, generated once and cached on disk."""
+    path = thumbnails.ensure_derivative(filename, size)
+    if not path:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=604800, immutable"})
+
+@app.get("/metrics")
+def get_metrics(token: Optional[str] = None):
+    """Prometheus scrape endpoint. Set METRICS_TOKEN to require ?token=... ."""
+    expected = os.getenv("METRICS_TOKEN")
+    if expected and token != expected:
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Serve Uploads
 app.mount("/uploads", CachedStaticFiles(directory="uploads"), name="uploads")
 
@@ -756,7 +953,7 @@ if os.path.exists(frontend_path):
     async def serve_frontend(full_path: str):
         # Serve index.html for all non-API routes to handle SPA routing
         # Check if it's an API route first
-        api_prefixes = ["auth/", "upload-meal", "stats", "meal/", "settings", "users/"]
+        api_prefixes = ["auth/", "upload-meal", "stats", "meal/", "settings", "users/", "media/", "metrics", "history"]
         if any(full_path.startswith(p) for p in api_prefixes):
             raise HTTPException(status_code=404)
         
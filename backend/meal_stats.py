@@ -0,0 +1,177 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import or_, text
+import database
+
+# Dashboard history only looks this far back; older days live behind /history
+HISTORY_WINDOW_DAYS = int(os.getenv("STATS_HISTORY_WINDOW_DAYS", "30"))
+HISTORY_DAYS = 7
+# Largest page /history will return
+HISTORY_MAX_DAYS = 31
+TREND_DAYS = 7
+# change_log rows kept per user; /stats/changes asks for a full reload past this
+CHANGE_LOG_KEEP = int(os.getenv("STATS_CHANGE_LOG_KEEP", "1000"))
+
+def _day_start(day):
+    return datetime(day.year, day.month, day.day)
+
+def day_totals(db, user_id, start_day, end_day):
+    """
+    Per-day totals for user_id between start_day and end_day (inclusive),
+    read from daily_rollups: one row per logged day. Newest day first.
+    Returns [{"date": "YYYY-MM-DD", "calories", "protein", "carbs", "fat", "meals"}].
+    """
+    rows = db.query(database.DailyRollup).filter(
+        database.DailyRollup.user_id == user_id,
+        database.DailyRollup.date >= start_day.isoformat(),
+        database.DailyRollup.date <= end_day.isoformat(),
+        database.DailyRollup.meal_count > 0,
+    ).order_by(database.DailyRollup.date.desc()).all()
+    return [_totals_row(r) for r in rows]
+
+def _totals_row(rollup):
+    return {"date": rollup.date, "calories": rollup.calories, "protein": rollup.protein,
+            "carbs": rollup.carbs, "fat": rollup.fat, "meals": rollup.meal_count}
+
+def mark_changed(db, user_id, date_str=None):
+    """
+    Bump users.data_version in the caller's transaction, so anything stamped
+    with the old version (share_cache) is stale once it commits, and log
+    which day changed for /stats/changes. date_str=None means "not one day"
+    (e.g. the daily target) and makes pollers reload everything.
+    """
+    params = {"u": user_id, "d": date_str, "keep": CHANGE_LOG_KEEP}
+    db.execute(text("UPDATE users SET data_version = COALESCE(data_version, 0) + 1 WHERE id = :u"), params)
+    db.execute(text(
+        "INSERT INTO change_log (user_id, version, date) SELECT id, data_version, :d FROM users WHERE id = :u"
+    ), params)
+    db.execute(text(
+        "DELETE FROM change_log WHERE user_id = :u "
+        "AND version <= (SELECT data_version FROM users WHERE id = :u) - :keep"
+    ), params)
+
+def changes(db, user_id, since):
+    """
+    (current version, dates changed after `since`). The date set is empty when
+    nothing changed and None when the caller has to reload everything: a
+    target change, a version older than the retained log, or a bogus `since`.
+    """
+    version = db.query(database.User.data_version).filter(database.User.id == user_id).scalar() or 0
+    if since == version:
+        return version, set()
+    if since > version or since < 0:
+        return version, None
+    rows = db.query(database.ChangeLog.version, database.ChangeLog.date).filter(
+        database.ChangeLog.user_id == user_id,
+        database.ChangeLog.version > since,
+    ).all()
+    # Every bump logs exactly one row, so a short count means the log was pruned
+    if len({v for v, _ in rows}) < version - since or any(d is None for _, d in rows):
+        return version, None
+    return version, {d for _, d in rows}
+
+def refresh_day(db, user_id, day):
+    """
+    Recompute one day's rollup from its meals inside the caller's transaction
+    and mark the user changed. Call after adding, changing or deleting a meal
+    and before db.commit().
+    """
+    db.flush()
+    date_str = day.isoformat()
+    mark_changed(db, user_id, date_str)
+    db.execute(text("DELETE FROM daily_rollups WHERE user_id = :u AND date = :d"), {"u": user_id, "d": date_str})
+    db.execute(
+        text(database.ROLLUP_INSERT + " WHERE user_id = :u AND timestamp >= :start AND timestamp < :end GROUP BY user_id, date(timestamp)"),
+        {"u": user_id, "start": f"{date_str} 00:00:00", "end": f"{(day + timedelta(days=1)).isoformat()} 00:00:00"}
+    )
+
+def totals_for_day(db, user_id, day):
+    """Totals for a single day, zeros if nothing was logged."""
+    rows = day_totals(db, user_id, day, day)
+    if rows:
+        return rows[0]
+    return {"date": day.isoformat(), "calories": 0, "protein": 0, "carbs": 0, "fat": 0, "meals": 0}
+
+def trend(db, user_id, today, days=TREND_DAYS):
+    """Calories per calendar day for the last `days` days, oldest first, zero-filled."""
+    by_date = {row["date"]: row["calories"] for row in day_totals(db, user_id, today - timedelta(days=days - 1), today)}
+    return [
+        {"day": day.strftime("%a"), "amount": by_date.get(day.isoformat(), 0)}
+        for day in (today - timedelta(days=i) for i in range(days - 1, -1, -1))
+    ]
+
+def recent_day_groups(db, user_id, today, days=HISTORY_DAYS, window_days=HISTORY_WINDOW_DAYS):
+    """
+    The `days` most recent days with meals inside the window, newest first:
+    [(totals row, [Meal, ...newest first])]. Only meals from those days are loaded.
+    """
+    totals = day_totals(db, user_id, today - timedelta(days=window_days - 1), today)[:days]
+    return _with_meals(db, user_id, totals)
+
+def history_page(db, user_id, before=None, days=HISTORY_DAYS):
+    """
+    One keyset page of history: the `days` newest logged days strictly before
+    `before` (a date, None for the newest), as [(totals row, [Meal, ...])].
+    Returns (day_groups, next_before); pass next_before back for the following
+    page, it is None once the oldest day has been returned. Days are unique per
+    user, so the (date, id) key never splits a day across pages.
+    """
+    days = max(1, min(days, HISTORY_MAX_DAYS))
+    query = db.query(database.DailyRollup).filter(
+        database.DailyRollup.user_id == user_id,
+        database.DailyRollup.meal_count > 0,
+    )
+    if before is not None:
+        query = query.filter(database.DailyRollup.date < before.isoformat())
+    rows = query.order_by(database.DailyRollup.date.desc(), database.DailyRollup.id.desc()).limit(days + 1).all()
+    totals = [_totals_row(r) for r in rows[:days]]
+    next_before = totals[-1]["date"] if len(rows) > days else None
+    return _with_meals(db, user_id, totals), next_before
+
+def day_groups_for(db, user_id, dates):
+    """[(totals row, [Meal, ...])] for just these dates (newest first); days without meals are left out."""
+    if not dates:
+        return []
+    rows = db.query(database.DailyRollup).filter(
+        database.DailyRollup.user_id == user_id,
+        database.DailyRollup.date.in_(list(dates)),
+        database.DailyRollup.meal_count > 0,
+    ).order_by(database.DailyRollup.date.desc()).all()
+    totals = [_totals_row(r) for r in rows]
+    if not totals:
+        return []
+    ranges = []
+    for row in totals:
+        day = datetime.strptime(row["date"], "%Y-%m-%d").date()
+        ranges.append((database.Meal.timestamp >= _day_start(day)) & (database.Meal.timestamp < _day_start(day + timedelta(days=1))))
+    meals = db.query(database.Meal).filter(
+        database.Meal.user_id == user_id,
+        or_(*ranges),
+    ).order_by(database.Meal.timestamp.desc(), database.Meal.id.desc()).all()
+    return _group_meals(totals, meals)
+
+def _with_meals(db, user_id, totals):
+    """Attach each day's meals (newest first) to a newest-first list of totals rows."""
+    if not totals:
+        return []
+    oldest = datetime.strptime(totals[-1]["date"], "%Y-%m-%d").date()
+    newest = datetime.strptime(totals[0]["date"], "%Y-%m-%d").date()
+    meals = db.query(database.Meal).filter(
+        database.Meal.user_id == user_id,
+        database.Meal.timestamp >= _day_start(oldest),
+        database.Meal.timestamp < _day_start(newest + timedelta(days=1)),
+    ).order_by(database.Meal.timestamp.desc(), database.Meal.id.desc()).all()
+    return _group_meals(totals, meals)
+
+def _group_meals(totals, meals):
+    by_date = {}
+    for meal in meals:
+        by_date.setdefault(meal.timestamp.date().isoformat(), []).append(meal)
+    return [(row, by_date.get(row["date"], [])) for row in totals]
+
+def notes_for_days(db, model, user_id, dates):
+    """{date: content} from DailyFeedback / DailySummary, restricted to the given dates."""
+    if not dates:
+        return {}
+    rows = db.query(model.date, model.content).filter(model.user_id == user_id, model.date.in_(list(dates))).all()
+    return {date: content for date, content in rows}
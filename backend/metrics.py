@@ -0,0 +1,111 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds: millisecond index scans up to 30s+ uploads
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_meta = {}        # name -> (type, help)
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_collectors = []
+
+def describe(name, kind, help_text):
+    _meta[name] = (kind, help_text)
+
+describe("fuel_stage_seconds", "histogram", "Time spent in each stage of the meal analysis / summary pipeline")
+describe("fuel_http_request_seconds", "histogram", "FastAPI request latency by route template")
+describe("fuel_gemini_calls_total", "counter", "Gemini attempts per key/model by outcome")
+describe("fuel_gemini_rate_limited_total", "counter", "Gemini 429 / quota responses per key/model")
+describe("fuel_result_cache_total", "counter", "Analysis result cache lookups")
+describe("fuel_hpb_nutrient_lookups_total", "counter", "HPB nutrient lookups by where they were served from")
+describe("fuel_share_cache_total", "counter", "Public share view requests by cache outcome")
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        row = _histograms.get(key)
+        if row is None:
+            row = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+
+@contextmanager
+def span(stage, **labels):
+    """Time a block into fuel_stage_seconds{stage=...}, even if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("fuel_stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+def register_collector(collect):
+    """
+    collect() is called on every scrape and returns (name, type, help, samples)
+    tuples, samples being (labels dict, value) pairs. Used by modules that
+    already keep their own counters (embedding cache, key scheduler).
+    """
+    _collectors.append(collect)
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render():
+    """Prometheus text exposition format (0.0.4)."""
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(row) for key, row in _histograms.items()}
+
+    def header(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for name in sorted({n for n, _ in counters}):
+        kind, help_text = _meta.get(name, ("counter", name))
+        header(name, kind, help_text)
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+    for name in sorted({n for n, _ in histograms}):
+        kind, help_text = _meta.get(name, ("histogram", name))
+        header(name, kind, help_text)
+        for (n, labels), row in sorted(histograms.items()):
+            if n != name:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, row):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {row[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {row[-2]:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {row[-1]}")
+
+    for collect in _collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            print(f"Metrics collector error: {e}")
+            continue
+        for name, kind, help_text, samples in families:
+            header(name, kind, help_text)
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+
+    return "\n".join(lines) + "\n"
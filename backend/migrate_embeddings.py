@@ -0,0 +1,43 @@
+import sqlite3
+import hpb_index
+
+# Configuration
+DB_PATH = "calorie_tracker.db"
+
+def migrate_embeddings():
+    """
+    One-shot migration: rewrite legacy JSON-text embeddings as binary float32
+    BLOBs and export the memory-mapped sidecar used by ai_engine.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT crId, embedding FROM hpb_embeddings WHERE typeof(embedding) = 'text'")
+    rows = cursor.fetchall()
+
+    if not rows:
+        print("All embeddings are already stored as binary.")
+    else:
+        print(f"Converting {len(rows)} JSON embeddings to float32 BLOBs...")
+        for i, (crId, value) in enumerate(rows):
+            vec, _ = hpb_index.decode_embedding(value)
+            cursor.execute("UPDATE hpb_embeddings SET embedding = ? WHERE crId = ?",
+                           (hpb_index.encode_embedding(vec), crId))
+            if (i + 1) % 1000 == 0:
+                conn.commit()
+                print(f"  Converted {i + 1}/{len(rows)}...")
+        conn.commit()
+
+    conn.close()
+
+    if rows:
+        # Reclaim the space freed by the much smaller BLOBs
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("VACUUM")
+        conn.close()
+
+    count = hpb_index.write_sidecar(DB_PATH)
+    print(f"✓ Wrote {hpb_index.SIDECAR_PATH} with {count} vectors.")
+
+if __name__ == "__main__":
+    migrate_embeddings()
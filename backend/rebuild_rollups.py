@@ -0,0 +1,20 @@
+import argparse
+import logging
+import database
+
+# Setup basic logging to see progress
+logging.basicConfig(level=logging.INFO)
+
+def rebuild_rollups(user_id=None):
+    """Recompute daily_rollups from the meals table (all users, or just one)."""
+    database.init_db()
+    with database.engine.begin() as conn:
+        database.rebuild_daily_rollups(conn, user_id)
+        rows = conn.execute(database.text("SELECT COUNT(*) FROM daily_rollups")).scalar()
+    logging.info(f"daily_rollups rebuilt ({rows} rows).")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the daily_rollups table from meals")
+    parser.add_argument("--user-id", type=int, help="only rebuild this user's days")
+    args = parser.parse_args()
+    rebuild_rollups(args.user_id)
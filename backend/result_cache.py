@@ -0,0 +1,85 @@
+import sqlite3
+import hashlib
+import json
+import os
+import time
+
+# Configuration
+DB_PATH = "calorie_tracker.db"
+TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_DAYS", "30")) * 86400
+MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "5000"))
+
+_table_ready = False
+
+def _connect():
+    global _table_ready
+    conn = sqlite3.connect(DB_PATH)
+    if not _table_ready:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL,
+                last_used REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_analysis_cache_last_used ON analysis_cache (last_used)")
+        conn.commit()
+        _table_ready = True
+    return conn
+
+def make_key(image_blobs, description, pipeline_version):
+    """
+    SHA-256 over the image bytes (in order), the normalized description and
+    the pipeline version, so a pipeline change never serves stale answers.
+    """
+    h = hashlib.sha256()
+    h.update(f"v={pipeline_version}\n".encode("utf-8"))
+    for blob in image_blobs or []:
+        h.update(hashlib.sha256(blob).digest())
+    h.update(b"\ndesc=")
+    h.update(" ".join(str(description or "").lower().split()).encode("utf-8"))
+    return h.hexdigest()
+
+def get(key):
+    """Return the cached (food_name, cals, p, c, f, items) tuple, or None."""
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT result, created_at FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            if time.time() - (row[1] or 0) > TTL_SECONDS:
+                conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE analysis_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        finally:
+            conn.close()
+        return tuple(json.loads(row[0]))
+    except Exception as e:
+        print(f"Result cache read error: {e}")
+        return None
+
+def put(key, result):
+    """Store a pipeline result and evict expired / least recently used rows."""
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, result, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(list(result)), now, now)
+            )
+            conn.execute("DELETE FROM analysis_cache WHERE created_at < ?", (now - TTL_SECONDS,))
+            conn.execute("""
+                DELETE FROM analysis_cache WHERE key IN (
+                    SELECT key FROM analysis_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (MAX_ENTRIES,))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Result cache write error: {e}")
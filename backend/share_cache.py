@@ -0,0 +1,46 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Rendered /public/stats payloads, one entry per share token
+MAX_ENTRIES = int(os.getenv("SHARE_CACHE_MAX_ENTRIES", "1000"))
+
+_entries = OrderedDict()  # token -> (stamp, body bytes)
+_lock = threading.Lock()
+
+def make_stamp(user, today_str):
+    """
+    What the public payload depends on: the user's data_version (bumped by
+    meal_stats.mark_changed on every meal, feedback, summary or target change)
+    and the day, since "Today" moves at midnight.
+    """
+    return f"{user.id}:{user.data_version or 0}:{today_str}"
+
+def etag(stamp):
+    return '"' + hashlib.sha256(stamp.encode("utf-8")).hexdigest()[:32] + '"'
+
+def matches(if_none_match, tag):
+    """If-None-Match check (weak comparison, as RFC 9110 asks for GET)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    return tag in candidates or ("W/" + tag) in candidates
+
+def get(token, stamp):
+    """The cached body for token if it was rendered at this stamp, else None."""
+    with _lock:
+        entry = _entries.get(token)
+        if entry is None or entry[0] != stamp:
+            return None
+        _entries.move_to_end(token)
+        return entry[1]
+
+def put(token, stamp, body):
+    with _lock:
+        _entries[token] = (stamp, body)
+        _entries.move_to_end(token)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
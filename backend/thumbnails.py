@@ -0,0 +1,79 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import image_prep
+
+# Configuration
+UPLOAD_DIR = "uploads"
+DERIVED_DIR = os.path.join(UPLOAD_DIR, "derived")
+# Derivative name -> longest edge in pixels
+SIZES = {
+    "thumb": int(os.getenv("THUMB_MAX_EDGE", "320")),
+    "medium": int(os.getenv("MEDIUM_MAX_EDGE", "960"))
+}
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+_lock = threading.Lock()
+_in_progress = {}
+
+def derivative_path(filename, size):
+    return os.path.join(DERIVED_DIR, size, f"{filename}.jpg")
+
+def ensure_derivative(filename, size):
+    """
+    Return the on-disk path of a derivative, generating it on first use.
+    None if the size is unknown or the original does not exist.
+    """
+    filename = os.path.basename(filename)
+    if size not in SIZES or not filename:
+        return None
+    target = derivative_path(filename, size)
+    if os.path.exists(target):
+        return target
+    original = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.isfile(original):
+        return None
+
+    # One writer per derivative; concurrent requests wait for it instead of re-encoding
+    with _lock:
+        event = _in_progress.get(target)
+        owner = event is None
+        if owner:
+            event = _in_progress[target] = threading.Event()
+    if not owner:
+        event.wait(timeout=30)
+        return target if os.path.exists(target) else None
+
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        data = image_prep.normalize_image(original, max_edge=SIZES[size])
+        tmp = f"{target}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+        return target
+    except Exception as e:
+        print(f"Error generating {size} derivative for {filename}: {e}")
+        return None
+    finally:
+        with _lock:
+            _in_progress.pop(target, None)
+        event.set()
+
+def generate_in_background(image_paths):
+    """Queue thumb + medium derivatives for freshly uploaded images."""
+    for path in image_paths or []:
+        for size in SIZES:
+            _executor.submit(ensure_derivative, os.path.basename(path), size)
+
+def image_urls(image_paths_json):
+    """Original, medium and thumbnail URLs for a meal's image_paths column."""
+    if not image_paths_json or not image_paths_json.startswith('['):
+        return {"images": [], "images_medium": [], "thumbnails": []}
+    names = [os.path.basename(p) for p in json.loads(image_paths_json)]
+    return {
+        "images": [f"/uploads/{n}" for n in names],
+        "images_medium": [f"/media/medium/{n}" for n in names],
+        "thumbnails": [f"/media/thumb/{n}" for n in names]
+    }
@@ -6,6 +6,47 @@ import axios from 'axios';
 // Configure Axios Defaults
 axios.defaults.baseURL = import.meta.env.VITE_API_URL || '';
 
+// A /stats/changes delta can't be merged when the server asks for a full reload
+// or today's AI summary was invalidated (/stats regenerates it)
+const needsStatsReload = (changes) =>
+  changes.full || changes.days.some((day) => day.date === changes.today && !day.ai_summary);
+
+// Apply a /stats/changes delta to the dashboard data
+const mergeStatsChanges = (data, changes) => {
+  const changed = Object.fromEntries(changes.days.map((day) => [day.date, day]));
+  const todayEntry = changed[changes.today];
+
+  const shown = data.grouped_history;
+  const oldest = shown.length >= 7 ? shown[shown.length - 1].date : '';
+  const history = shown
+    .filter((day) => !changed[day.date] && !changes.removed.includes(day.date))
+    .concat(changes.days.filter((day) => day.date >= oldest))
+    .sort((a, b) => (a.date < b.date ? 1 : -1))
+    .slice(0, 7);
+
+  const next = { ...data, grouped_history: history };
+  const todayMs = Date.parse(changes.today);
+  next.trend = data.trend.map((point, i) => {
+    const date = new Date(todayMs - (data.trend.length - 1 - i) * 86400000).toISOString().slice(0, 10);
+    if (changed[date]) return { ...point, amount: changed[date].totals.calories };
+    if (changes.removed.includes(date)) return { ...point, amount: 0 };
+    return point;
+  });
+  if (todayEntry) {
+    Object.assign(next, {
+      consumed: todayEntry.totals.calories,
+      protein: todayEntry.totals.protein,
+      carbs: todayEntry.totals.carbs,
+      fat: todayEntry.totals.fat,
+      daily_summary: todayEntry.ai_summary
+    });
+  } else if (changes.removed.includes(changes.today)) {
+    Object.assign(next, { consumed: 0, protein: 0, carbs: 0, fat: 0, daily_summary: 'Log your first meal to get insights!' });
+  }
+  next.version = changes.version;
+  return next;
+};
+
 const App = () => {
   const [view, setView] = useState('loading'); // loading, login, register, dashboard, verify
   const [token, setToken] = useState(localStorage.getItem('jinu_token'));
@@ -28,6 +69,8 @@ const App = () => {
   const [adminData, setAdminStats] = useState(null);
   const [isRefreshing, setIsRefreshing] = useState(false);
   const fileInputRef = useRef(null);
+  const statsVersion = useRef(null);
+  const statsDay = useRef(null);
 
   const mealTypes = [
     { name: 'Breakfast', icon: <Coffee size={14} /> },
@@ -61,9 +104,9 @@ const App = () => {
       return () => clearInterval(interval);
     } else if (token) {
       checkAuth();
-      const interval = setInterval(() => fetchData(token, true), 30000);
+      const interval = setInterval(() => pollChanges(token), 30000);
       const handleVisibility = () => {
-        if (document.visibilityState === 'visible') fetchData(token, true);
+        if (document.visibilityState === 'visible') pollChanges(token);
       };
       window.addEventListener('visibilitychange', handleVisibility);
       return () => {
@@ -100,6 +143,8 @@ const App = () => {
         headers: { Authorization: `Bearer ${authToken}` }
       });
       setData(response.data);
+      statsVersion.current = response.data.version;
+      statsDay.current = new Date().toDateString();
     } catch (err) {
       console.error("Fetch failed", err);
     } finally {
@@ -108,6 +153,25 @@ const App = () => {
     }
   };
 
+  // Polls merge the changed days from /stats/changes; /stats is only re-fetched
+  // when the server asks for it (full) or the day rolled over
+  const pollChanges = async (authToken) => {
+    if (statsVersion.current == null || statsDay.current !== new Date().toDateString()) {
+      return fetchData(authToken, true);
+    }
+    try {
+      const res = await axios.get(`/stats/changes?since=${statsVersion.current}`, {
+        headers: { Authorization: `Bearer ${authToken}` }
+      });
+      if (res.status === 204) return;
+      if (needsStatsReload(res.data)) return fetchData(authToken, true);
+      setData((prev) => mergeStatsChanges(prev, res.data));
+      statsVersion.current = res.data.version;
+    } catch (err) {
+      console.error("Change check failed", err);
+    }
+  };
+
   const handleVerifyEmail = async (v_token) => {
     if (!v_token) {
       setAuthError("No verification token provided.");
@@ -389,8 +453,10 @@ const App = () => {
               {meal.images && meal.images.length > 0 ? (
                 meal.images.map((img, i) => (
                   <div key={i} className="min-w-full snap-center relative flex items-center justify-center overflow-hidden">
-                    <img src={img} className="absolute inset-0 w-full h-full object-cover blur-2xl opacity-30 scale-110" />
-                    <img src={img} className="relative z-10 w-full max-h-[70vh] object-contain shadow-2xl" style={{ minHeight: '300px' }} />
+                    <img src={meal.thumbnails?.[i] || img} className="absolute inset-0 w-full h-full object-cover blur-2xl opacity-30 scale-110" />
+                    <a href={img} target="_blank" rel="noreferrer" className="relative z-10 w-full" onClick={(e) => e.stopPropagation()}>
+                      <img src={meal.images_medium?.[i] || img} className="w-full max-h-[70vh] object-contain shadow-2xl" style={{ minHeight: '300px' }} />
+                    </a>
                   </div>
                 ))
               ) : (
@@ -717,7 +783,7 @@ const App = () => {
               <div className="space-y-4">
                 {day.meals.map((meal) => (
                   <div key={meal.id} onClick={() => setSelectedMeal(meal)} className="group bg-slate-900/50 border border-slate-800 p-4 rounded-[28px] flex items-center transition-all hover:bg-slate-800/60 cursor-pointer">
-                    <div className="w-20 h-20 rounded-2xl overflow-hidden mr-4 border-2 border-slate-800 shadow-xl shrink-0 bg-slate-800 flex items-center justify-center relative">{meal.images && meal.images.length > 0 ? (<><img src={meal.images[0]} alt={meal.food} className="w-full h-full object-cover" />{meal.images.length > 1 && <div className="absolute bottom-1 right-1 bg-indigo-600 text-white text-[8px] font-black px-1.5 py-0.5 rounded-md shadow-lg border border-indigo-400">+{meal.images.length - 1}</div>}</>) : (<Utensils className="text-slate-600" size={24} />)}<div className="absolute inset-0 bg-black/40 opacity-0 group-hover:opacity-100 transition-opacity flex items-center justify-center"><Maximize2 className="text-white" size={20} /></div></div>
+                    <div className="w-20 h-20 rounded-2xl overflow-hidden mr-4 border-2 border-slate-800 shadow-xl shrink-0 bg-slate-800 flex items-center justify-center relative">{meal.images && meal.images.length > 0 ? (<><img src={meal.thumbnails?.[0] || meal.images[0]} alt={meal.food} className="w-full h-full object-cover" />{meal.images.length > 1 && <div className="absolute bottom-1 right-1 bg-indigo-600 text-white text-[8px] font-black px-1.5 py-0.5 rounded-md shadow-lg border border-indigo-400">+{meal.images.length - 1}</div>}</>) : (<Utensils className="text-slate-600" size={24} />)}<div className="absolute inset-0 bg-black/40 opacity-0 group-hover:opacity-100 transition-opacity flex items-center justify-center"><Maximize2 className="text-white" size={20} /></div></div>
                     <div className="flex-1 min-w-0 pr-2"><div className="flex items-center gap-2 mb-1"><span className="text-[8px] font-black uppercase px-1.5 py-0.5 bg-slate-800 text-slate-400 rounded-md">{meal.meal_type || 'Meal'}</span><h3 className="font-bold text-slate-100 text-base truncate">{meal.food}</h3></div>
                     {meal.items && meal.items.length > 0 && <div className="flex flex-wrap gap-x-3 gap-y-1 mt-1 mb-2">{meal.items.map((item, idx) => (<div key={idx} className="flex items-center gap-1 text-[10px] font-medium text-slate-400"><span className="text-indigo-400 font-bold">{item.portion}x</span><span className="truncate max-w-[100px]">{item.name}</span></div>))}</div>}
                     <div className="flex items-center gap-2 mb-2 text-[10px] text-slate-500 font-bold uppercase"><Clock size={10} /> {new Date(meal.time).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })}</div>